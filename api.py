@@ -1,18 +1,31 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from pydantic import BaseModel, Field, constr
-from src.bot.context import BotContext
-from src.database.models import DatabaseManager
+from pydantic import BaseModel, Field, ValidationError, constr
+from src.bot.async_context import ChatSession
+from src.bot.admission import OverloadedError
+from src.bot.context import ERROR_RESPONSE
+from src.container import components
 from src.dashboard.analytics import router as analytics_router
 from src.utils.lead_tracker import router as leads_router
 from src.utils.conversation_viewer import router as conversations_router
+from src.utils.health import ReadinessProbe
+from src.utils.compression import CompressionMiddleware
+from src.utils.metrics import REGISTRY, MetricsMiddleware
+from src.utils.idempotency import IdempotencyConflict, IdempotencyStore
+from src.utils.lifecycle import ShuttingDown, lifecycle
+from src.utils.rate_limit import RateLimiter, RateLimitExceeded
 import uvicorn
 import os
 from dotenv import load_dotenv
 import uuid
+import json
+import hashlib
 import logging
-from typing import Optional
+import asyncio
+import time
+from typing import List, Optional
 from fastapi.security import APIKeyHeader
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.staticfiles import StaticFiles
@@ -34,6 +47,9 @@ load_dotenv()
 PORT = int(os.getenv("PORT", 8080))
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "").split(",")
 API_KEY = os.getenv("API_KEY")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+BATCH_PARALLELISM = int(os.getenv("CHAT_BATCH_PARALLELISM", 4))
+BATCH_MAX_PARALLELISM = int(os.getenv("CHAT_BATCH_MAX_PARALLELISM", 16))
 
 if not API_KEY:
     raise ValueError("API_KEY environment variable is required")
@@ -46,6 +62,8 @@ app = FastAPI(
 
 # Security middleware
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -54,9 +72,68 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize components
-db_manager = DatabaseManager()
-bot_context = BotContext()
+# Shared components, built in the background once the server is up
+idempotency_store = IdempotencyStore()
+rate_limiter = RateLimiter.from_env()
+
+async def check_database():
+    await components.ready()
+    await components.async_db.ping()
+
+async def check_anthropic():
+    await components.ready()
+    await components.bot_context.ping_upstream()
+
+readiness = ReadinessProbe({
+    "database": check_database,
+    "anthropic_api": check_anthropic
+})
+
+def bot_stat(read):
+    """Read a bot counter for a gauge, reporting 0 until the bot is built"""
+    return read(components.bot_context) if components.is_built("bot_context") else 0
+
+# Upstream state sampled at scrape time
+REGISTRY.gauge("movne_llm_in_flight", "Claude calls currently running",
+               lambda: bot_stat(lambda bot: bot.admission.in_flight))
+REGISTRY.gauge("movne_llm_queue_depth", "Requests waiting for a Claude slot",
+               lambda: bot_stat(lambda bot: bot.admission.waiting))
+REGISTRY.gauge("movne_rate_limited", "Requests rejected by the token-bucket rate limiter since start",
+               lambda: rate_limiter.rejected)
+REGISTRY.gauge("movne_llm_circuit_open", "1 while the Claude circuit breaker answers from canned content",
+               lambda: bot_stat(lambda bot: int(bot.llm.breaker.is_open())))
+REGISTRY.gauge("movne_llm_coalesced", "Requests served by another in-flight identical call since start",
+               lambda: bot_stat(lambda bot: bot.single_flight.coalesced))
+
+@app.on_event("startup")
+async def init_components():
+    # Do not wait for the bot and database here: the port binds right away and
+    # /readyz reports 503 until warm-up finishes
+    components.warm_up()
+    readiness.start()
+
+async def require_components():
+    """Wait for component warm-up so early requests never build them on the event loop"""
+    await components.ready()
+
+def shutting_down_exception(error: ShuttingDown) -> HTTPException:
+    """503 telling the client to retry against another instance"""
+    return HTTPException(
+        status_code=503,
+        detail="Server is restarting. Please try again shortly.",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+async def accept_chats():
+    """Refuse new chats once shutdown has started"""
+    if lifecycle.draining:
+        raise shutting_down_exception(ShuttingDown())
+
+@app.on_event("shutdown")
+async def drain_and_stop():
+    # Normally already started by the SIGTERM handler in GracefulServer
+    await lifecycle.drain()
+    await readiness.stop()
 
 # Models
 class ChatRequest(BaseModel):
@@ -75,6 +152,18 @@ class ChatResponse(BaseModel):
 class ErrorResponse(BaseModel):
     detail: str
 
+class BatchChatItem(BaseModel):
+    conversation_id: Optional[str] = Field(None, description="Conversation identifier, a new one is created if omitted")
+    message: str = Field(..., min_length=1, max_length=4000, description="User message")
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchChatItem] = Field(..., min_length=1, max_length=1000)
+    parallelism: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Concurrent items, defaults to CHAT_BATCH_PARALLELISM"
+    )
+
 # Security
 api_key_header = APIKeyHeader(name="X-API-Key")
 
@@ -86,6 +175,49 @@ async def verify_api_key(api_key: str = Depends(api_key_header)):
         )
     return api_key
 
+def client_ip(connection) -> Optional[str]:
+    """Client address, taking the hop appended by the platform router when proxied"""
+    forwarded = connection.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
+    return connection.client.host if connection.client else None
+
+def api_key_id(api_key: str) -> str:
+    """Hashed API key, safe to keep in memory or write to logs"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def rate_limit_identities(api_key: str, conversation_id: Optional[str], ip: Optional[str]) -> dict:
+    return {
+        "api_key": api_key_id(api_key),
+        "conversation": conversation_id,
+        "ip": ip
+    }
+
+def rate_limited_exception(error: RateLimitExceeded) -> HTTPException:
+    logger.warning(f"Rate limited chat request: {str(error)}")
+    return HTTPException(
+        status_code=429,
+        detail=f"Rate limit exceeded ({error.scope}). Please slow down.",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+async def enforce_rate_limit(request: Request, api_key: str = Depends(verify_api_key)):
+    """Token-bucket throttling per API key, conversation_id and client IP"""
+    conversation_id = None
+    try:
+        # FastAPI has already read the body, this returns the cached copy
+        body = await request.json()
+        if isinstance(body, dict):
+            conversation_id = body.get("conversation_id")
+    except Exception:
+        pass
+    
+    try:
+        await rate_limiter.check(rate_limit_identities(api_key, conversation_id, client_ip(request)))
+    except RateLimitExceeded as e:
+        raise rate_limited_exception(e)
+    return api_key
+
 # Include routers
 app.include_router(
     analytics_router,
@@ -103,44 +235,118 @@ app.include_router(
     dependencies=[Depends(verify_api_key)]
 )
 
+def overloaded_exception(error: OverloadedError) -> HTTPException:
+    """429 response telling the client when to retry"""
+    logger.warning(f"Rejecting chat request: {str(error)}")
+    return HTTPException(
+        status_code=429,
+        detail="Too many concurrent requests. Please try again shortly.",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+async def cancel_on_disconnect(http_request: Request, work):
+    """Await work, cancelling it if the client disconnects first.
+
+    Returns (result, disconnected). The request body has already been read, so
+    the next ASGI message is http.disconnect once the client goes away.
+    """
+    task = asyncio.ensure_future(work)
+
+    async def wait_for_disconnect():
+        while (await http_request.receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if task.done():
+        return task.result(), False
+    
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return None, True
+
 # Routes
+async def process_chat(request: ChatRequest) -> ChatResponse:
+    """Run one chat turn through the bot and return its response"""
+    conversation_id = request.conversation_id or str(uuid.uuid4())
+    
+    logger.info(f"Processing chat request - Conversation ID: {conversation_id}")
+    
+    async with lifecycle.track():
+        # Ensure conversation exists
+        await components.async_db.create_conversation_if_not_exists(conversation_id)
+        
+        # Get bot response
+        response = await components.bot_context.get_response_async(
+            request.message,
+            components.async_db,
+            conversation_id
+        )
+    
+    logger.info(f"Successfully processed chat request - Conversation ID: {conversation_id}")
+    
+    return ChatResponse(
+        response=response,
+        conversation_id=conversation_id
+    )
+
 @app.post("/api/chat", 
          response_model=ChatResponse,
+         dependencies=[Depends(accept_chats), Depends(enforce_rate_limit), Depends(require_components)],
          responses={
              400: {"model": ErrorResponse},
-             500: {"model": ErrorResponse}
+             422: {"model": ErrorResponse},
+             429: {"model": ErrorResponse},
+             500: {"model": ErrorResponse},
+             503: {"model": ErrorResponse}
          })
 async def chat_endpoint(
     request: ChatRequest,
-    api_key: str = Depends(verify_api_key)
+    http_request: Request,
+    http_response: Response,
+    api_key: str = Depends(verify_api_key),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
 ):
     """
     Process a chat message and return the bot's response.
     
     - If no conversation_id is provided, a new one will be created
     - Messages are saved to the database for context and analytics
+    - With an Idempotency-Key header, retries of the same request return the
+      stored response (or wait for the original) instead of running it again
+    - Without one, a client disconnect cancels the Claude call; the user message
+      is kept and the answer is saved as aborted
     """
     try:
-        conversation_id = request.conversation_id or str(uuid.uuid4())
-        
-        logger.info(f"Processing chat request - Conversation ID: {conversation_id}")
+        if not idempotency_key:
+            result, disconnected = await cancel_on_disconnect(http_request, process_chat(request))
+            if disconnected:
+                logger.info("Client disconnected, chat request cancelled")
+                return Response(status_code=499)
+            return result
         
-        # Ensure conversation exists
-        db_manager.create_conversation_if_not_exists(conversation_id)
-        
-        # Get bot response
-        response = bot_context.get_response(
-            request.message,
-            db_manager,
-            conversation_id
-        )
-        
-        logger.info(f"Successfully processed chat request - Conversation ID: {conversation_id}")
-        
-        return ChatResponse(
-            response=response,
-            conversation_id=conversation_id
+        # Keeps running if the client disconnects, so its retry gets the answer
+        result, replayed = await idempotency_store.run(
+            f"{api_key_id(api_key)}:{idempotency_key}",
+            IdempotencyStore.fingerprint(request.model_dump()),
+            lambda: process_chat(request),
+            cacheable=lambda result: result.response != ERROR_RESPONSE
         )
+        if replayed:
+            http_response.headers["Idempotent-Replayed"] = "true"
+        return result
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except OverloadedError as e:
+        raise overloaded_exception(e)
+    except ShuttingDown as e:
+        raise shutting_down_exception(e)
     except Exception as e:
         logger.error(f"Error in chat_endpoint: {str(e)}", exc_info=True)
         if isinstance(e, HTTPException):
@@ -150,7 +356,227 @@ async def chat_endpoint(
             detail="Internal server error occurred. Please try again later."
         )
 
-@app.get("/health")
+@app.post("/api/chat/batch", dependencies=[Depends(accept_chats), Depends(require_components)])
+async def chat_batch_endpoint(
+    request: BatchChatRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Run many chat messages concurrently, e.g. for offline answer review.
+    
+    - Items run through the regular chat pipeline and are saved like any chat
+    - At most `parallelism` items run at once (capped by CHAT_BATCH_MAX_PARALLELISM)
+    - Results stream back as NDJSON lines in completion order, each tagged with its index
+    """
+    parallelism = min(request.parallelism or BATCH_PARALLELISM, BATCH_MAX_PARALLELISM)
+    limiter = asyncio.Semaphore(parallelism)
+    logger.info(f"Processing chat batch - {len(request.items)} items, parallelism {parallelism}")
+    
+    async def run_item(index: int, item: BatchChatItem) -> dict:
+        conversation_id = item.conversation_id or str(uuid.uuid4())
+        async with limiter:
+            started = time.monotonic()
+            result = {"index": index, "conversation_id": conversation_id}
+            try:
+                async with lifecycle.track():
+                    await components.async_db.create_conversation_if_not_exists(conversation_id)
+                    result["response"] = await components.bot_context.get_response_async(
+                        item.message,
+                        components.async_db,
+                        conversation_id
+                    )
+            except (OverloadedError, ShuttingDown) as e:
+                result["error"] = str(e) if isinstance(e, ShuttingDown) else "Too many concurrent requests"
+                result["retry_after"] = e.retry_after
+            except Exception as e:
+                logger.error(f"Error in chat batch item {index}: {str(e)}", exc_info=True)
+                result["error"] = "Internal server error occurred."
+            result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+            return result
+    
+    async def result_stream():
+        tasks = [asyncio.ensure_future(run_item(i, item)) for i, item in enumerate(request.items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+        finally:
+            # Client went away, stop the remaining items
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+def format_sse(event: str, data: dict) -> str:
+    """Format a Server-Sent-Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/chat/stream",
+         dependencies=[Depends(accept_chats), Depends(enforce_rate_limit), Depends(require_components)],
+         responses={
+             400: {"model": ErrorResponse},
+             429: {"model": ErrorResponse},
+             500: {"model": ErrorResponse},
+             503: {"model": ErrorResponse}
+         })
+async def chat_stream_endpoint(
+    request: ChatRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Process a chat message and stream the bot's response as Server-Sent Events.
+    
+    - `start` carries the conversation_id before the first token
+    - `delta` events carry response text as it is generated
+    - `done` carries the full final response, as saved to the database
+    """
+    conversation_id = request.conversation_id or str(uuid.uuid4())
+    logger.info(f"Processing chat stream request - Conversation ID: {conversation_id}")
+    
+    # Reject before committing to a 200 stream when the queue is already full
+    if components.bot_context.admission.is_saturated():
+        raise overloaded_exception(OverloadedError(components.bot_context.admission.retry_after()))
+    
+    try:
+        await components.async_db.create_conversation_if_not_exists(conversation_id)
+    except Exception as e:
+        logger.error(f"Error in chat_stream_endpoint: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Internal server error occurred. Please try again later."
+        )
+    
+    async def event_stream():
+        yield format_sse("start", {"conversation_id": conversation_id})
+        parts = []
+        chunks = components.bot_context.stream_response(
+            request.message,
+            components.async_db,
+            conversation_id
+        )
+        try:
+            async with lifecycle.track():
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    yield format_sse("delta", {"text": chunk})
+        except OverloadedError as e:
+            yield format_sse("error", {"detail": "Too many concurrent requests", "retry_after": e.retry_after})
+            return
+        except ShuttingDown as e:
+            yield format_sse("error", {"detail": str(e), "retry_after": e.retry_after})
+            return
+        finally:
+            # Closes the Claude stream right away when the client disconnects
+            await chunks.aclose()
+        yield format_sse("done", {"conversation_id": conversation_id, "response": "".join(parts)})
+        logger.info(f"Successfully streamed chat request - Conversation ID: {conversation_id}")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/chat/ws")
+async def chat_websocket(
+    websocket: WebSocket,
+    conversation_id: Optional[str] = None,
+    api_key: Optional[str] = None
+):
+    """
+    Chat over a single WebSocket with the conversation kept in memory.
+    
+    - Authenticate once with the X-API-Key header or the api_key query parameter
+    - Send {"message": "..."} frames; responses stream back as
+      {"type": "delta", "text": ...} followed by {"type": "done", "response": ...}
+    """
+    if (websocket.headers.get("X-API-Key") or api_key) != API_KEY:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    await components.ready()
+    conversation_id = conversation_id or str(uuid.uuid4())
+    session = ChatSession(components.db_manager, conversation_id)
+    
+    try:
+        await session.load()
+        await websocket.send_json({"type": "session", "conversation_id": conversation_id})
+        logger.info(f"Chat WebSocket opened - Conversation ID: {conversation_id}")
+        
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                request = ChatRequest.model_validate(json.loads(raw))
+            except (ValueError, ValidationError) as e:
+                await websocket.send_json({"type": "error", "detail": f"Invalid message: {str(e)}"})
+                continue
+            
+            try:
+                await rate_limiter.check(rate_limit_identities(API_KEY, conversation_id, client_ip(websocket)))
+            except RateLimitExceeded as e:
+                await websocket.send_json({
+                    "type": "error",
+                    "detail": f"Rate limit exceeded ({e.scope})",
+                    "retry_after": e.retry_after
+                })
+                continue
+            
+            parts = []
+            chunks = components.bot_context.stream_response(request.message, session, conversation_id)
+            try:
+                async with lifecycle.track():
+                    async for chunk in chunks:
+                        parts.append(chunk)
+                        await websocket.send_json({"type": "delta", "text": chunk})
+            except ShuttingDown as e:
+                # Tell the client to reconnect to another instance
+                await websocket.send_json({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+                await websocket.close(code=status.WS_1012_SERVICE_RESTART)
+                return
+            except OverloadedError as e:
+                await websocket.send_json({
+                    "type": "error",
+                    "detail": "Too many concurrent requests",
+                    "retry_after": e.retry_after
+                })
+                continue
+            finally:
+                # A failed send means the client is gone; stop the Claude stream
+                await chunks.aclose()
+            await websocket.send_json({"type": "done", "response": "".join(parts)})
+    except WebSocketDisconnect:
+        logger.info(f"Chat WebSocket closed - Conversation ID: {conversation_id}")
+    except Exception as e:
+        logger.error(f"Error in chat_websocket: {str(e)}", exc_info=True)
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+
+@app.get("/livez")
+async def liveness_probe():
+    """Liveness probe: the process is up and serving, no I/O performed"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness_probe():
+    """
+    Readiness probe served from cached dependency checks.
+    
+    Database and Anthropic checks run in the background every READINESS_TTL
+    seconds, so the probe itself never touches the database or the API.
+    """
+    if lifecycle.draining:
+        return JSONResponse(status_code=503, content={"status": "shutting down", "in_flight": lifecycle.in_flight})
+    snapshot = readiness.snapshot()
+    return JSONResponse(
+        status_code=200 if snapshot["ready"] else 503,
+        content={"status": "ready" if snapshot["ready"] else "not ready", **snapshot}
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, cache hits, LLM tokens and DB operations"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health", dependencies=[Depends(require_components)])
 async def health_check(api_key: str = Depends(verify_api_key)):
     """
     Check the health status of the API and its dependencies.
@@ -162,11 +588,11 @@ async def health_check(api_key: str = Depends(verify_api_key)):
     try:
         # Test database connection
         test_conversation_id = str(uuid.uuid4())
-        db_manager.create_conversation_if_not_exists(test_conversation_id)
+        await components.async_db.create_conversation_if_not_exists(test_conversation_id)
         
         # Test Anthropic API
-        response = bot_context.client.messages.create(
-            model="claude-3-opus-20240229",
+        response = await components.bot_context.async_client.messages.create(
+            model=components.bot_context.router.cheapest_model(),
             max_tokens=10,
             messages=[{"role": "user", "content": "test"}]
         )
@@ -174,7 +600,10 @@ async def health_check(api_key: str = Depends(verify_api_key)):
         return {
             "status": "healthy",
             "database": "connected",
-            "anthropic_api": "connected"
+            "anthropic_api": "connected",
+            "llm_admission": components.bot_context.admission.stats(),
+            "llm_circuit": components.bot_context.llm.breaker.stats(),
+            "prompt_version": components.bot_context.prompt_template.version
         }
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}", exc_info=True)
@@ -191,6 +620,15 @@ async def root():
     """Redirect to API documentation"""
     return get_swagger_ui_html(openapi_url="/openapi.json", title="Movne Bot API Documentation")
 
+class GracefulServer(uvicorn.Server):
+    """uvicorn server that starts draining chats as soon as SIGTERM arrives"""
+
+    def handle_exit(self, sig, frame):
+        # Refuse new chats and start the drain deadline before uvicorn waits
+        # for open connections, so long streams cannot outlive the deadline
+        lifecycle.begin_drain()
+        super().handle_exit(sig, frame)
+
 if __name__ == "__main__":
     logger.info(f"Starting server on port {PORT}")
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    GracefulServer(uvicorn.Config(app, host="0.0.0.0", port=PORT)).run()
@@ -0,0 +1,98 @@
+"""Compare message scans: per-pattern substring loops against RuleEngine.scan.
+
+Generates synthetic Hebrew patterns like the ones in sales_responses.yaml and
+builds a RuleEngine over them with the default keyword rules, as BotContext
+does. The loop baseline checks every canned pattern and every rule class
+separately, as the bot did before the rule engine. Both must find the same
+canned pattern and rule classes for every prompt. Prints build time and
+per-message latency as the pattern count grows, for a first scan and for a
+repeated check of the same text, which the engine serves from its cache:
+
+    python benchmark_patterns.py --patterns 100 1000 5000 20000
+"""
+import argparse
+import random
+import re
+import sys
+import time
+
+from src.bot.rules import DEFAULT_RULE_CLASSES, RuleEngine
+
+LETTERS = "אבגדהוזחטיכלמנסעפצקרשת"
+
+
+def random_word(rng: random.Random, low: int = 3, high: int = 8) -> str:
+    return "".join(rng.choice(LETTERS) for _ in range(rng.randint(low, high)))
+
+
+def make_patterns(count: int, rng: random.Random) -> list:
+    patterns = set()
+    while len(patterns) < count:
+        words = [random_word(rng) for _ in range(rng.choice((1, 1, 2)))]
+        patterns.add(" ".join(words))
+    return list(patterns)
+
+
+def make_prompts(count: int, patterns: list, rng: random.Random) -> list:
+    """Question-length prompts; half of them contain a pattern somewhere"""
+    prompts = []
+    for i in range(count):
+        words = [random_word(rng) for _ in range(rng.randint(6, 20))]
+        if i % 2 == 0:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(patterns))
+        prompts.append(" ".join(words))
+    return prompts
+
+
+def naive_scan(patterns: list, text: str):
+    """(matched rule classes, first canned pattern index or None), one loop per pattern and class"""
+    text = text.lower()
+    canned = next((index for index, pattern in enumerate(patterns) if pattern in text), None)
+    classes = frozenset(rule_class for rule_class, rule in DEFAULT_RULE_CLASSES.items()
+                        if any(keyword in text for keyword in rule.get('keywords') or [])
+                        or any(re.search(pattern, text, re.IGNORECASE) for pattern in rule.get('patterns') or []))
+    return classes, canned
+
+
+def per_lookup(function, prompts: list) -> float:
+    """Mean seconds per lookup over all prompts"""
+    started = time.perf_counter()
+    for prompt in prompts:
+        function(prompt)
+    return (time.perf_counter() - started) / len(prompts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patterns", type=int, nargs="+", default=[10, 100, 1000, 5000, 20000],
+                        help="pattern counts to benchmark")
+    parser.add_argument("--prompts", type=int, default=500, help="prompts looked up per pattern count")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'patterns':>9} {'build ms':>9} {'loop us':>9} {'scan us':>9} {'cached us':>10} {'speedup':>8}")
+    for count in args.patterns:
+        patterns = make_patterns(count, rng)
+        prompts = make_prompts(args.prompts, patterns, rng)
+
+        started = time.perf_counter()
+        engine = RuleEngine(DEFAULT_RULE_CLASSES, patterns, cache_size=args.prompts)
+        build = time.perf_counter() - started
+
+        # First pass fills the scan cache; the results are checked against the loops
+        first = per_lookup(engine.scan, prompts)
+        mismatches = sum(1 for prompt in prompts
+                         if tuple(engine.scan(prompt)) != naive_scan(patterns, prompt))
+        if mismatches:
+            print(f"FAIL: {mismatches} prompts scanned differently with {count} patterns")
+            sys.exit(1)
+
+        loop = per_lookup(lambda prompt: naive_scan(patterns, prompt), prompts)
+        cached = per_lookup(engine.scan, prompts)
+        print(f"{count:>9} {build * 1000:>9.1f} {loop * 1e6:>9.1f} {first * 1e6:>9.1f} {cached * 1e6:>10.1f} "
+              f"{loop / first:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
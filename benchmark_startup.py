@@ -0,0 +1,136 @@
+"""Measure cold-start cost of the API.
+
+Reports how long `import api` takes in a fresh interpreter, the slowest
+modules it imports, and how long a freshly spawned uvicorn takes to answer
+its first request (/livez) and to report ready (/readyz).
+
+Exits with status 1 when the median import time exceeds the budget, so it
+can run as a deploy check:
+
+    python benchmark_startup.py --budget 1.0
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import api; print(time.perf_counter() - t)"
+
+
+def child_env() -> dict:
+    env = dict(os.environ)
+    # api.py refuses to import without an API key
+    env.setdefault("API_KEY", "startup-benchmark")
+    return env
+
+
+def measure_import(runs: int) -> list:
+    """Seconds spent importing api.py, once per fresh interpreter"""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            capture_output=True, text=True, env=child_env(), check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def slowest_imports(limit: int) -> list:
+    """(cumulative seconds, module) for the slowest modules api.py imports directly, from -X importtime"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api"],
+        capture_output=True, text=True, env=child_env(), check=True
+    ).stderr
+    # Children are printed before their parent and indented two more spaces
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = len(name) - len(name.lstrip())
+        if depth == 3:
+            children.append((int(cumulative) / 1e6, name.strip()))
+        elif depth == 1:
+            if name.strip() == "api":
+                return sorted(children, reverse=True)[:limit]
+            children = []
+    return []
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, started: float, timeout: float, expect_ok: bool = False):
+    """Seconds since started until url answers (with a 2xx when expect_ok), or None"""
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return time.perf_counter() - started
+        except urllib.error.HTTPError:
+            if not expect_ok:
+                return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def measure_first_request(timeout: float) -> tuple:
+    """(seconds to first /livez response, seconds to a ready /readyz) for a fresh server"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--log-level", "warning"],
+        env=child_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        first_request = wait_for(f"{base_url}/livez", started, timeout)
+        ready = wait_for(f"{base_url}/readyz", started, timeout, expect_ok=True) if first_request else None
+        return first_request, ready
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters used to time the import")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET", 1.0)),
+                        help="maximum median import time in seconds (IMPORT_TIME_BUDGET)")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the server")
+    parser.add_argument("--skip-server", action="store_true", help="only measure the import")
+    args = parser.parse_args()
+
+    timings = measure_import(args.runs)
+    median = statistics.median(timings)
+    print(f"import api: median {median * 1000:.0f} ms, "
+          f"min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms over {args.runs} runs")
+
+    print("slowest imports (cumulative):")
+    for seconds, module in slowest_imports(args.top):
+        print(f"  {seconds * 1000:8.1f} ms  {module}")
+
+    if not args.skip_server:
+        first_request, ready = measure_first_request(args.timeout)
+        print(f"first request (/livez): {'timed out' if first_request is None else f'{first_request * 1000:.0f} ms'}")
+        print(f"ready (/readyz 200): {'not ready' if ready is None else f'{ready * 1000:.0f} ms'}")
+
+    if median > args.budget:
+        print(f"FAIL: import time {median:.2f}s exceeds budget {args.budget:.2f}s")
+        sys.exit(1)
+    print(f"OK: import time within budget {args.budget:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
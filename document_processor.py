@@ -5,7 +5,6 @@ import sys
 from datetime import datetime
 import os
 import sqlite3
-import pandas as pd
 from typing import Dict, List, Optional, Union
 import re
 from collections import defaultdict
@@ -122,11 +122,13 @@ function movne_chat_widget_code() {
             messageDiv.textContent = message;
             messagesContainer.appendChild(messageDiv);
             messagesContainer.scrollTop = messagesContainer.scrollHeight;
+            return messageDiv;
         }
 
         async function sendMessage(message) {
+            let botMessage = null;
             try {
-                const response = await fetch('<?php echo $railway_url; ?>/api/chat', {
+                const response = await fetch('<?php echo $railway_url; ?>/api/chat/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
@@ -137,12 +139,53 @@ function movne_chat_widget_code() {
                     })
                 });
 
-                const data = await response.json();
-                conversationId = data.conversation_id;
-                addMessage(data.response, 'bot');
+                if (!response.ok || !response.body) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+
+                // Read Server-Sent Events and append text as it arrives
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const frames = buffer.split('\n\n');
+                    buffer = frames.pop();
+                    for (const frame of frames) {
+                        const eventLine = frame.split('\n').find(line => line.startsWith('event: '));
+                        const dataLine = frame.split('\n').find(line => line.startsWith('data: '));
+                        if (!eventLine || !dataLine) continue;
+                        const event = eventLine.slice(7);
+                        const data = JSON.parse(dataLine.slice(6));
+                        if (event === 'start') {
+                            conversationId = data.conversation_id;
+                        } else if (event === 'delta') {
+                            if (!botMessage) botMessage = addMessage('', 'bot');
+                            botMessage.textContent += data.text;
+                            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                        } else if (event === 'done') {
+                            if (!botMessage) botMessage = addMessage('', 'bot');
+                            botMessage.textContent = data.response;
+                        } else if (event === 'error') {
+                            // Server overloaded or restarting: say so and when to retry
+                            const retry = data.retry_after ? ` אנא נסה שוב בעוד ${data.retry_after} שניות.` : ' אנא נסה שוב.';
+                            const text = `מצטער, לא ניתן לענות כרגע (${data.detail}).${retry}`;
+                            if (botMessage && botMessage.textContent) {
+                                addMessage(text, 'bot');
+                            } else {
+                                if (!botMessage) botMessage = addMessage('', 'bot');
+                                botMessage.textContent = text;
+                            }
+                        }
+                    }
+                }
             } catch (error) {
                 console.error('Error:', error);
-                addMessage('מצטער, אירעה שגיאה. אנא נסה שוב.', 'bot');
+                if (!botMessage) {
+                    addMessage('מצטער, אירעה שגיאה. אנא נסה שוב.', 'bot');
+                }
             }
         }
     });
@@ -6,9 +6,14 @@ import logging
 import sys
 import os
 from src.database.models import DatabaseManager
-from src.bot.context import BotContext
+from src.bot.context import BotContext, ERROR_RESPONSE, PROMPT_CACHING, SUMMARY_HEADING
+from src.bot.prompts import PromptTemplate
+from src.bot.resilience import LLMUnavailable
+from src.bot.async_context import AsyncBotContext, AsyncDatabase
+from src.bot.response_cache import ResponseCache
 from dotenv import load_dotenv
 from document_processor import DocumentProcessor
+from src.utils.metrics import STAGE_LATENCY
 import anthropic
 import re
 
@@ -36,8 +41,22 @@ app.add_middleware(
 
 class EnhancedBotContext(BotContext):
     def __init__(self):
-        super().__init__()
+        # Needed by _compile_system_prompt, which runs during BotContext.__init__
         self.document_processor = DocumentProcessor()
+        super().__init__()
+
+    def _compile_system_prompt(self) -> PromptTemplate:
+        """Core knowledge goes in the stable text; document snippets and the conversation summary are slots"""
+        return PromptTemplate("sales_documents", self._get_system_prompt(), slots=(
+            ("documents", "מידע נוסף מהמסמכים:"),
+            ("summary", SUMMARY_HEADING)
+        ))
+
+    def _fallback_candidates(self):
+        """Canned answers plus the core document knowledge"""
+        candidates = super()._fallback_candidates()
+        candidates.extend((text, text) for text in self.document_processor.knowledge_base.values())
+        return candidates
 
     def _get_system_prompt(self) -> str:
         """Override system prompt to include document processor info"""
@@ -69,55 +88,65 @@ class EnhancedBotContext(BotContext):
 
         ענה בצורה טבעית ומקצועית, כמו יועץ השקעות מנוסה שמסביר ללקוח."""
 
+    def _build_claude_request(self, prompt: str, conversation_history=None, summary: str = "",
+                              summarized: int = 0) -> dict:
+        """Override to add document knowledge after the cached system prompt"""
+        # Get additional relevant info from documents
+        with STAGE_LATENCY.time(stage="knowledge_query"):
+            relevant_info = self.document_processor.query_knowledge(prompt)
+
+        # Documents, then the newest history, are kept while they fit the token budget
+        documents, recent = self._pack_prompt(prompt, relevant_info,
+                                              self._recent_history(conversation_history, summarized), summary)
+        doc_info = "\n".join(documents)
+
+        route = self._route_turn(prompt, conversation_history, retrieved=len(relevant_info))
+        return {
+            'messages': self._history_messages(recent) + [{"role": "user", "content": prompt}],
+            'model': route.model,
+            'max_tokens': route.max_tokens,
+            'temperature': 0.7,
+            # Document info and the summary change per request, so they follow the cached prefix
+            'system': self.prompt_template.render(cache=PROMPT_CACHING, documents=doc_info, summary=summary)
+        }
+
     def _get_claude_response(self, prompt: str, db_manager, conversation_id: str) -> str:
         """Override to include document processor info in the response"""
         try:
+            self._advance_qualification(db_manager, conversation_id, prompt)
+
             # Get conversation history
-            conversation_history = db_manager.get_conversation_history(conversation_id)
-            history_text = "\n".join([f"{'לקוח' if msg[0] == 'user' else 'נציג'}: {msg[1]}" for msg in conversation_history[-3:]])
-            
-            # Get additional relevant info from documents
-            relevant_info = self.document_processor.query_knowledge(prompt)
-            doc_info = "\n".join(relevant_info) if relevant_info else ""
-            
-            # Add document info to system prompt
-            system_prompt = self._get_system_prompt()
-            if doc_info:
-                system_prompt += f"\n\nמידע נוסף מהמסמכים:\n{doc_info}"
-            if history_text:
-                system_prompt += f"\n\nהיסטוריית השיחה האחרונה:\n{history_text}"
+            conversation_history = self._load_history(db_manager, conversation_id)
 
             # Get response from Claude
-            response = self.client.messages.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="claude-3-opus-20240229",
-                max_tokens=800,
-                temperature=0.7,
-                system=system_prompt
-            )
-
-            bot_response = response.content[0].text if response.content else "מצטער, לא הצלחתי להבין. אנא נסה שוב."
-            
-            # Add form links if relevant
-            bot_response = self.add_form_links_if_needed(bot_response)
-            
-            # Add legal disclaimer if needed
-            if self._needs_legal_disclaimer(bot_response):
-                bot_response = self._add_legal_disclaimer(bot_response)
+            try:
+                response = self._create_message(self._build_claude_request(prompt, conversation_history))
+                bot_response = self._finalize_response(self._extract_text(response))
+            except LLMUnavailable as e:
+                bot_response = self._finalize_response(self._fallback_response(prompt, e.reason))
             
             # Save messages
-            db_manager.save_message(conversation_id, "user", prompt)
-            db_manager.save_message(conversation_id, "assistant", bot_response)
+            self._save_exchange(db_manager, conversation_id, prompt, bot_response)
             
             return bot_response
 
         except Exception as e:
             logging.error(f"Claude API error: {str(e)}")
-            return "מצטער, אירעה שגיאה. אנא נסה שוב."
+            return ERROR_RESPONSE
+
+class AsyncEnhancedBotContext(AsyncBotContext, EnhancedBotContext):
+    """EnhancedBotContext running on the async Anthropic client"""
+
+    async def _get_rule_based_response_async(self, prompt: str, db, conversation_id: str):
+        """Override to skip the rules and always answer with document info and history"""
+        await self._advance_qualification_async(db, conversation_id, prompt)
+        conversation_history = await db.get_conversation_history(conversation_id)
+        return None, conversation_history
 
 # Initialize database manager and bot context
 db_manager = DatabaseManager()
-bot_context = EnhancedBotContext()
+async_db = AsyncDatabase(db_manager)
+bot_context = AsyncEnhancedBotContext(response_cache=ResponseCache(db_manager))
 
 @app.post("/chat/")
 async def chat(prompt: str, conversation_id: str = None):
@@ -129,13 +158,13 @@ async def chat(prompt: str, conversation_id: str = None):
         # Generate a new conversation ID if not provided
         if not conversation_id:
             conversation_id = str(uuid.uuid4())
-            db_manager.create_conversation_if_not_exists(conversation_id)
+            await async_db.create_conversation_if_not_exists(conversation_id)
         
         # Log the received prompt
         logging.info(f"Received prompt: {prompt}")
 
         # Get bot response
-        response = bot_context._get_claude_response(prompt, db_manager, conversation_id)
+        response = await bot_context._get_claude_response_async(prompt, async_db, conversation_id)
 
         # Return the response with conversation ID
         return {
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from src.utils.metrics import LLM_REJECTED, REGISTRY
+
+QUEUE_WAIT = REGISTRY.histogram(
+    "movne_llm_queue_wait_seconds", "Time spent waiting for an LLM admission slot"
+)
+
+
+class OverloadedError(Exception):
+    """Raised when the LLM wait queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"LLM upstream overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency limiter with a bounded wait queue for upstream LLM calls.
+
+    At most max_concurrent calls run at once and at most max_queue callers wait
+    for a slot. Callers beyond that, or callers that wait longer than
+    queue_timeout seconds, get OverloadedError carrying a Retry-After estimate.
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None, max_queue: Optional[int] = None,
+                 queue_timeout: Optional[float] = None):
+        self.max_concurrent = max_concurrent or int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('LLM_MAX_QUEUE', 32))
+        self.queue_timeout = queue_timeout or float(os.getenv('LLM_QUEUE_TIMEOUT', 30))
+
+        # Created on first use so it binds to the server's event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_service_time = 5.0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def is_saturated(self) -> bool:
+        """True when a new caller would be rejected right away"""
+        return self.in_flight >= self.max_concurrent and self.waiting >= self.max_queue
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue is expected to drain"""
+        batches = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(batches * self.avg_service_time))
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        LLM_REJECTED.inc(reason=reason)
+        retry_after = self.retry_after()
+        logging.warning(f"LLM admission rejected ({reason}), in flight: {self.in_flight}, "
+                        f"waiting: {self.waiting}, retry after {retry_after}s")
+        raise OverloadedError(retry_after)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one upstream slot for the duration of the block"""
+        semaphore = self._get_semaphore()
+        queued_at = time.monotonic()
+        if semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self._reject("queue full")
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject("queue timeout")
+            finally:
+                self.waiting -= 1
+        else:
+            await semaphore.acquire()
+
+        wait = time.monotonic() - queued_at
+        QUEUE_WAIT.observe(wait)
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+        self.in_flight += 1
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+            # Exponentially weighted service time for Retry-After estimates
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * (time.monotonic() - started_at)
+
+    def stats(self) -> Dict:
+        return {
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'queue_depth': self.waiting,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'avg_wait_seconds': round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            'max_wait_seconds': round(self.max_wait, 4),
+            'avg_service_seconds': round(self.avg_service_time, 4)
+        }
@@ -0,0 +1,715 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from .context import BotContext, ERROR_RESPONSE
+from .admission import AdmissionController, OverloadedError
+from .qualification import QualificationState, ensure_qualification_columns, read_qualification, write_qualification
+from .resilience import LLMUnavailable
+from .single_flight import SingleFlight
+from src.utils.lifecycle import lifecycle
+from src.utils.metrics import DB_OPERATIONS, LLM_REQUESTS, STAGE_LATENCY, record_llm_cancelled, record_llm_usage
+
+# messages.status value for an assistant turn cut off before it finished
+ABORTED = "aborted"
+
+# Instructions for folding older turns into the conversation summary
+SUMMARY_SYSTEM_PROMPT = """סכם בקצרה את השיחה בין לקוח לנציג של מובנה גלובל, בכמה משפטים בעברית.
+שמור את מה שחשוב להמשך השיחה: מה הלקוח מחפש, שאלות שנשארו פתוחות, האם הוא משקיע כשיר, ומה הנציג הציע או הבטיח.
+אם יש סיכום קודם, עדכן אותו במקום לחזור עליו. החזר רק את הסיכום."""
+
+
+def add_column(conn, table: str, column: str, sql_type: str = "TEXT"):
+    """ALTER TABLE ADD COLUMN that tolerates another worker adding the column first"""
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}")
+    except sqlite3.OperationalError as e:
+        if "duplicate column" not in str(e):
+            raise
+
+
+class AsyncDatabase:
+    """Non-blocking facade over DatabaseManager.
+
+    sqlite3 calls run in the default thread pool so the event loop keeps
+    serving other chats while a query is in flight.
+    """
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self._message_columns_ready = False
+        self._conversation_columns_ready = False
+
+    async def create_conversation_if_not_exists(self, conversation_id: str):
+        DB_OPERATIONS.inc(operation="create_conversation")
+        with STAGE_LATENCY.time(stage="db_create_conversation"):
+            await asyncio.to_thread(self.db_manager.create_conversation_if_not_exists, conversation_id)
+
+    async def get_conversation_history(self, conversation_id: str, limit: int = None) -> List[Tuple[str, str]]:
+        """(role, content) messages in order, without replies that were cut off"""
+        def _history():
+            conn = self.db_manager.get_connection()
+            try:
+                self._ensure_message_columns(conn)
+                query = """SELECT role, content FROM messages
+                           WHERE conversation_id = ? AND (status IS NULL OR status != ?)
+                           ORDER BY timestamp ASC"""
+                params = (conversation_id, ABORTED)
+                if limit:
+                    query += " LIMIT ?"
+                    params += (limit,)
+                return conn.execute(query, params).fetchall()
+            finally:
+                conn.close()
+        DB_OPERATIONS.inc(operation="get_history")
+        with STAGE_LATENCY.time(stage="db_history"):
+            return await asyncio.to_thread(_history)
+
+    async def save_message(self, conversation_id: str, role: str, content: str):
+        DB_OPERATIONS.inc(operation="save_message")
+        with STAGE_LATENCY.time(stage="db_save"):
+            await asyncio.to_thread(self.db_manager.save_message, conversation_id, role, content)
+
+    async def delete_unanswered_prompt(self, conversation_id: str, prompt: str):
+        """Remove the latest user message with this text, saved for a turn that was then refused"""
+        def _delete():
+            conn = self.db_manager.get_connection()
+            try:
+                conn.execute(
+                    """DELETE FROM messages WHERE message_id = (
+                           SELECT message_id FROM messages WHERE conversation_id = ? AND role = 'user' AND content = ?
+                           ORDER BY timestamp DESC LIMIT 1)""",
+                    (conversation_id, prompt)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        DB_OPERATIONS.inc(operation="delete_message")
+        with STAGE_LATENCY.time(stage="db_save"):
+            await asyncio.to_thread(_delete)
+
+    async def ping(self):
+        """Read-only connectivity check"""
+        def _ping():
+            conn = self.db_manager.get_connection()
+            try:
+                conn.execute("SELECT 1").fetchone()
+            finally:
+                conn.close()
+        await asyncio.to_thread(_ping)
+
+    def _ensure_message_columns(self, conn):
+        # DatabaseManager's schema has neither column; add them on first use
+        if self._message_columns_ready:
+            return
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(messages)")]
+        for column in ("status", "prompt_version"):
+            if column not in columns:
+                add_column(conn, "messages", column)
+        conn.commit()
+        self._message_columns_ready = True
+
+    def _ensure_conversation_columns(self, conn):
+        # The rolling summary and the qualification state live on the conversations row
+        if self._conversation_columns_ready:
+            return
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(conversations)")]
+        if "summary" not in columns:
+            add_column(conn, "conversations", "summary")
+        if "summary_message_count" not in columns:
+            add_column(conn, "conversations", "summary_message_count", "INTEGER")
+        ensure_qualification_columns(conn)
+        conn.commit()
+        self._conversation_columns_ready = True
+
+    async def get_summary(self, conversation_id: str) -> Tuple[str, int]:
+        """(summary, number of history messages it covers); ("", 0) before the first summary"""
+        def _get():
+            conn = self.db_manager.get_connection()
+            try:
+                self._ensure_conversation_columns(conn)
+                row = conn.execute(
+                    "SELECT summary, summary_message_count FROM conversations WHERE conversation_id = ?",
+                    (conversation_id,)
+                ).fetchone()
+            finally:
+                conn.close()
+            return (row[0] or "", row[1] or 0) if row else ("", 0)
+        DB_OPERATIONS.inc(operation="get_summary")
+        with STAGE_LATENCY.time(stage="db_summary"):
+            return await asyncio.to_thread(_get)
+
+    async def save_summary(self, conversation_id: str, summary: str, message_count: int):
+        """Store a summary covering the first message_count history messages, unless a newer one is stored"""
+        def _save():
+            conn = self.db_manager.get_connection()
+            try:
+                self._ensure_conversation_columns(conn)
+                conn.execute(
+                    """UPDATE conversations SET summary = ?, summary_message_count = ?
+                       WHERE conversation_id = ? AND COALESCE(summary_message_count, 0) < ?""",
+                    (summary, message_count, conversation_id, message_count)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        DB_OPERATIONS.inc(operation="save_summary")
+        with STAGE_LATENCY.time(stage="db_save"):
+            await asyncio.to_thread(_save)
+
+    async def get_qualification(self, conversation_id: str) -> Optional[QualificationState]:
+        """Stored qualified investor state, or None when the conversation has none yet"""
+        def _get():
+            conn = self.db_manager.get_connection()
+            try:
+                self._ensure_conversation_columns(conn)
+                return read_qualification(conn, conversation_id)
+            finally:
+                conn.close()
+        DB_OPERATIONS.inc(operation="get_qualification")
+        with STAGE_LATENCY.time(stage="db_qualification"):
+            return await asyncio.to_thread(_get)
+
+    async def save_qualification(self, conversation_id: str, state: QualificationState):
+        def _save():
+            conn = self.db_manager.get_connection()
+            try:
+                self._ensure_conversation_columns(conn)
+                write_qualification(conn, conversation_id, state)
+            finally:
+                conn.close()
+        DB_OPERATIONS.inc(operation="save_qualification")
+        with STAGE_LATENCY.time(stage="db_save"):
+            await asyncio.to_thread(_save)
+
+    def _insert_reply(self, conversation_id: str, content: str, prompt_version: Optional[str] = None,
+                      status: Optional[str] = None):
+        """Insert an assistant message with the columns DatabaseManager.save_message does not know"""
+        conn = self.db_manager.get_connection()
+        try:
+            self._ensure_message_columns(conn)
+            conn.execute(
+                """INSERT INTO messages (message_id, conversation_id, timestamp, role, content, status, prompt_version)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (str(uuid.uuid4()), conversation_id, datetime.now(), "assistant", content, status, prompt_version)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    async def save_reply(self, conversation_id: str, response: str, prompt_version: Optional[str] = None):
+        """Save a Claude answer with the version of the system prompt that produced it"""
+        DB_OPERATIONS.inc(operation="save_message")
+        with STAGE_LATENCY.time(stage="db_save"):
+            await asyncio.to_thread(self._insert_reply, conversation_id, response, prompt_version)
+
+    async def save_aborted_reply(self, conversation_id: str, partial_response: str,
+                                 prompt_version: Optional[str] = None):
+        """Save the part of an assistant answer sent before the turn was cut off, marked aborted"""
+        DB_OPERATIONS.inc(operation="save_aborted_reply")
+        with STAGE_LATENCY.time(stage="db_save"):
+            await asyncio.to_thread(self._insert_reply, conversation_id, partial_response, prompt_version, ABORTED)
+
+    async def save_exchange(self, conversation_id: str, prompt: str, response: str,
+                            prompt_version: Optional[str] = None):
+        """Save a user/assistant pair in a single worker hop"""
+        def _save():
+            self.db_manager.save_message(conversation_id, "user", prompt)
+            if prompt_version is None:
+                self.db_manager.save_message(conversation_id, "assistant", response)
+            else:
+                self._insert_reply(conversation_id, response, prompt_version)
+        DB_OPERATIONS.inc(2, operation="save_message")
+        with STAGE_LATENCY.time(stage="db_save"):
+            await asyncio.to_thread(_save)
+
+
+class ChatSession(AsyncDatabase):
+    """Conversation state kept in memory for the life of a chat connection.
+
+    The conversation row is ensured and the history loaded once in load();
+    afterwards history reads are served from memory and saves write through
+    to the database while updating the in-memory copy. The summary and the
+    qualification state are read once and kept up to date the same way.
+    """
+
+    def __init__(self, db_manager, conversation_id: str):
+        super().__init__(db_manager)
+        self.conversation_id = conversation_id
+        self.history: Optional[List[Tuple[str, str]]] = None
+        self.summary: Optional[Tuple[str, int]] = None
+        self.qualification: Optional[QualificationState] = None
+
+    async def load(self):
+        """Ensure the conversation row exists and load its history"""
+        await super().create_conversation_if_not_exists(self.conversation_id)
+        self.history = list(await super().get_conversation_history(self.conversation_id))
+
+    def _owns(self, conversation_id: str) -> bool:
+        return conversation_id == self.conversation_id and self.history is not None
+
+    async def create_conversation_if_not_exists(self, conversation_id: str):
+        if not self._owns(conversation_id):
+            await super().create_conversation_if_not_exists(conversation_id)
+
+    async def get_conversation_history(self, conversation_id: str, limit: int = None) -> List[Tuple[str, str]]:
+        if not self._owns(conversation_id):
+            return await super().get_conversation_history(conversation_id, limit)
+        return self.history[:limit] if limit else list(self.history)
+
+    async def save_message(self, conversation_id: str, role: str, content: str):
+        await super().save_message(conversation_id, role, content)
+        if self._owns(conversation_id):
+            self.history.append((role, content))
+
+    async def delete_unanswered_prompt(self, conversation_id: str, prompt: str):
+        await super().delete_unanswered_prompt(conversation_id, prompt)
+        if self._owns(conversation_id):
+            for index in range(len(self.history) - 1, -1, -1):
+                if self.history[index] == ("user", prompt):
+                    del self.history[index]
+                    break
+
+    async def save_exchange(self, conversation_id: str, prompt: str, response: str,
+                            prompt_version: Optional[str] = None):
+        await super().save_exchange(conversation_id, prompt, response, prompt_version)
+        if self._owns(conversation_id):
+            self.history.extend([("user", prompt), ("assistant", response)])
+
+    async def save_reply(self, conversation_id: str, response: str, prompt_version: Optional[str] = None):
+        await super().save_reply(conversation_id, response, prompt_version)
+        if self._owns(conversation_id):
+            self.history.append(("assistant", response))
+
+    async def get_summary(self, conversation_id: str) -> Tuple[str, int]:
+        if not self._owns(conversation_id):
+            return await super().get_summary(conversation_id)
+        if self.summary is None:
+            self.summary = await super().get_summary(conversation_id)
+        return self.summary
+
+    async def save_summary(self, conversation_id: str, summary: str, message_count: int):
+        await super().save_summary(conversation_id, summary, message_count)
+        if self._owns(conversation_id) and (self.summary is None or self.summary[1] < message_count):
+            self.summary = (summary, message_count)
+
+    async def get_qualification(self, conversation_id: str) -> Optional[QualificationState]:
+        if not self._owns(conversation_id):
+            return await super().get_qualification(conversation_id)
+        if self.qualification is None:
+            self.qualification = await super().get_qualification(conversation_id)
+        return self.qualification
+
+    async def save_qualification(self, conversation_id: str, state: QualificationState):
+        await super().save_qualification(conversation_id, state)
+        if self._owns(conversation_id):
+            self.qualification = state
+
+
+class AsyncBotContext(BotContext):
+    """BotContext variant for the FastAPI event loop.
+
+    Uses the async Anthropic client and AsyncDatabase so a slow Claude call or
+    sqlite query never blocks other requests on the same worker.
+    """
+
+    def __init__(self, *args, response_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        import anthropic
+        self.async_client = anthropic.AsyncAnthropic(api_key=os.getenv('ANTHROPIC_API_KEY'), max_retries=0)
+        logging.info("Async Anthropic client initialized successfully")
+
+        # Identical concurrent requests share one upstream call
+        self.single_flight = SingleFlight()
+
+        # Bounded concurrency in front of the Anthropic upstream
+        self.admission = AdmissionController()
+
+        # Answers reused for repeated questions; None always calls Claude
+        self.response_cache = response_cache
+
+        # Conversations whose summary is being regenerated
+        self._summarizing = set()
+        self.summary_max_tokens = int(os.getenv('SUMMARY_MAX_TOKENS', 300))
+
+    async def ping_upstream(self):
+        """Cheap authenticated Anthropic call that does not bill tokens"""
+        await self.async_client.models.list(limit=1)
+
+    @staticmethod
+    def _as_async_db(db_manager) -> AsyncDatabase:
+        return db_manager if isinstance(db_manager, AsyncDatabase) else AsyncDatabase(db_manager)
+
+    async def get_response_async(self, prompt: str, db_manager, conversation_id: str) -> str:
+        """Get response for user prompt without blocking the event loop"""
+        db = self._as_async_db(db_manager)
+        try:
+            logging.info(f"Getting response for prompt: {prompt}")
+
+            # Try cached response first
+            quick_response = self._get_cached_response(prompt)
+            if quick_response:
+                logging.info("Using cached response")
+                await self._advance_qualification_async(db, conversation_id, prompt)
+                await db.save_exchange(conversation_id, prompt, quick_response)
+                await self._record_qualification_reply_async(db, conversation_id, quick_response)
+                return quick_response
+
+            # Handle special cases and get Claude response
+            return await self._get_claude_response_async(prompt, db, conversation_id)
+
+        except OverloadedError:
+            raise
+        except Exception as e:
+            logging.error(f"Error in get_response_async: {str(e)}")
+            return ERROR_RESPONSE
+
+    async def _get_rule_based_response_async(self, prompt: str, db: AsyncDatabase, conversation_id: str) -> Tuple[Optional[str], Optional[List[Tuple[str, str]]]]:
+        """Apply the qualification and agreement rules.
+
+        Returns (response, conversation_history); a None response means Claude should answer.
+        """
+        state = await self._advance_qualification_async(db, conversation_id, prompt)
+
+        # Check if question is about returns
+        if self.is_question_requires_qualification(prompt):
+            handled, response = self._get_qualification_response(state)
+            if handled:
+                return response, None
+
+        # Check for agreement request
+        if self.is_agreement_request(prompt):
+            return self.handle_investor_response(False), None  # Use same function for agreement info
+
+        return None, None
+
+    async def _advance_qualification_async(self, db: AsyncDatabase, conversation_id: str,
+                                           prompt: str) -> QualificationState:
+        """Async counterpart of _advance_qualification"""
+        stored = await db.get_qualification(conversation_id)
+        state = stored or self.qualification.replay(await db.get_conversation_history(conversation_id))
+        state = self.qualification.on_message(state, 'user', prompt)
+        if state != stored:
+            await db.save_qualification(conversation_id, state)
+        return state
+
+    async def _record_qualification_reply_async(self, db: AsyncDatabase, conversation_id: str, response: str):
+        """Async counterpart of _record_qualification_reply"""
+        if not self.qualification.asks(response):
+            return
+        state = await db.get_qualification(conversation_id) or QualificationState()
+        next_state = self.qualification.on_message(state, 'assistant', response)
+        if next_state != state:
+            await db.save_qualification(conversation_id, next_state)
+
+    async def _get_claude_response_async(self, prompt: str, db: AsyncDatabase, conversation_id: str) -> str:
+        """Async counterpart of _get_claude_response"""
+        try:
+            response, conversation_history = await self._get_rule_based_response_async(prompt, db, conversation_id)
+            if response:
+                await db.save_exchange(conversation_id, prompt, response)
+                await self._record_qualification_reply_async(db, conversation_id, response)
+                return response
+
+            # Default to normal Claude response
+            return await self._get_normal_claude_response_async(prompt, db, conversation_id, conversation_history)
+
+        except OverloadedError:
+            raise
+        except Exception as e:
+            logging.error(f"Error in _get_claude_response_async: {str(e)}")
+            return ERROR_RESPONSE
+
+    async def _get_normal_claude_response_async(self, prompt: str, db: AsyncDatabase, conversation_id: str,
+                                                conversation_history: Optional[List[Tuple[str, str]]] = None) -> str:
+        """Get standard response from Claude using the async client"""
+        try:
+            if conversation_history is None:
+                conversation_history = await db.get_conversation_history(conversation_id)
+            summary, summarized = await db.get_summary(conversation_id)
+            request = self._build_claude_request(prompt, conversation_history, summary, summarized)
+            model = request.get('model', '')
+
+            cached = await self._lookup_response_cache(request)
+            if cached is not None:
+                bot_response = self._finalize_response(cached)
+                await db.save_exchange(conversation_id, prompt, bot_response, self.prompt_template.version)
+                await self._record_qualification_reply_async(db, conversation_id, bot_response)
+                return bot_response
+
+            # Open circuit: answer right away instead of queueing for a call that fails
+            if self.llm.breaker.is_open():
+                bot_response = self._finalize_response(self._fallback_response(prompt, "circuit_open"))
+                await db.save_exchange(conversation_id, prompt, bot_response)
+                await self._record_qualification_reply_async(db, conversation_id, bot_response)
+                return bot_response
+
+            # Saved before the call so the question survives a shutdown or crash
+            # mid-call; a request that is rejected is not kept, as it gets retried
+            if self.admission.is_saturated():
+                raise OverloadedError(self.admission.retry_after())
+            await db.save_message(conversation_id, "user", prompt)
+            try:
+                response = await self._create_message_async(request)
+            except OverloadedError:
+                # Queue timeout, or the last slot went to another request after the check
+                await db.delete_unanswered_prompt(conversation_id, prompt)
+                raise
+            except asyncio.CancelledError:
+                # Client disconnected or shutdown deadline; the upstream call is
+                # cancelled (and counted) unless another identical request still waits for it
+                self._abort_turn(db, conversation_id)
+                raise
+            except LLMUnavailable as e:
+                bot_response = self._finalize_response(self._fallback_response(prompt, e.reason))
+                await db.save_message(conversation_id, "assistant", bot_response)
+                await self._record_qualification_reply_async(db, conversation_id, bot_response)
+                return bot_response
+
+            raw_response = self._extract_text(response)
+            if self._is_complete(response):
+                self._store_response_cache(request, raw_response)
+            bot_response = self._finalize_response(raw_response)
+
+            await db.save_reply(conversation_id, bot_response, self.prompt_template.version)
+            await self._record_qualification_reply_async(db, conversation_id, bot_response)
+            self._maybe_summarize(db, conversation_id, conversation_history, summary, summarized)
+
+            return bot_response
+
+        except OverloadedError:
+            raise
+        except Exception as e:
+            logging.error(f"Claude API error: {str(e)}")
+            return ERROR_RESPONSE
+
+    async def _lookup_response_cache(self, request: Dict) -> Optional[str]:
+        """Raw answer text cached for an equivalent request, or None"""
+        if self.response_cache is None:
+            return None
+        try:
+            with STAGE_LATENCY.time(stage="response_cache"):
+                return await self.response_cache.lookup(request)
+        except Exception as e:
+            logging.error(f"Response cache lookup failed: {str(e)}")
+            return None
+
+    def _store_response_cache(self, request: Dict, raw_response: str):
+        """Cache a raw answer in the background; it is finalized again when served"""
+        if self.response_cache is not None:
+            lifecycle.spawn(self.response_cache.store(request, raw_response))
+
+    @staticmethod
+    def _is_complete(response) -> bool:
+        """Only full answers are worth caching, not truncated or empty ones"""
+        return bool(getattr(response, 'content', None)) and getattr(response, 'stop_reason', None) == "end_turn"
+
+    async def _create_message_async(self, request: Dict):
+        """Call Claude, coalescing identical concurrent requests.
+
+        The key covers the whole request payload (system prompt, history and
+        prompt), so only requests that do not depend on a particular
+        conversation's state can share a call. Each caller still finalizes and
+        persists the answer for its own conversation.
+        """
+        model = request.get('model', '')
+
+        async def _call():
+            async with self.admission.slot():
+                started = time.perf_counter()
+                try:
+                    with STAGE_LATENCY.time(stage="llm"):
+                        response = await self.llm.create_async(self.async_client, request)
+                except asyncio.CancelledError:
+                    # Only reached when the last waiter left and the shared call was cancelled
+                    LLM_REQUESTS.inc(model=model, outcome="cancelled")
+                    record_llm_cancelled(model)
+                    raise
+                except Exception:
+                    LLM_REQUESTS.inc(model=model, outcome="error")
+                    raise
+                LLM_REQUESTS.inc(model=model, outcome="ok")
+                record_llm_usage(model, response)
+                self.router.record_call(model, time.perf_counter() - started, response)
+                return response
+
+        key = SingleFlight.make_key(request)
+        return await self.single_flight.do(key, _call)
+
+    def _abort_turn(self, db: AsyncDatabase, conversation_id: str, partial_response: str = "",
+                    unsaved_prompt: Optional[str] = None):
+        """Persist a turn that was cut off: the user message if not saved yet and an aborted assistant reply.
+
+        The cancelled task cannot await the writes, so they run as a background
+        job that shutdown waits for.
+        """
+        logging.info(f"Chat turn aborted - Conversation ID: {conversation_id}")
+
+        async def _save():
+            if unsaved_prompt is not None:
+                await db.save_message(conversation_id, "user", unsaved_prompt)
+            await db.save_aborted_reply(conversation_id, partial_response, self.prompt_template.version)
+
+        lifecycle.spawn(_save())
+
+    def _maybe_summarize(self, db: AsyncDatabase, conversation_id: str, conversation_history: List[Tuple[str, str]],
+                         summary: str, summarized: int):
+        """Fold messages older than the window into the summary once a batch of them has built up.
+
+        conversation_history is the history before the current turn. The
+        summary is written by a background job, so the answer is not delayed.
+        """
+        if len(conversation_history) - summarized < self.history_window + self.summary_batch:
+            return
+        if conversation_id in self._summarizing:
+            return
+        upto = len(conversation_history) - self.history_window
+        self._summarizing.add(conversation_id)
+        lifecycle.spawn(self._summarize(db, conversation_id, conversation_history[summarized:upto], summary, upto))
+
+    async def _summarize(self, db: AsyncDatabase, conversation_id: str, messages: List[Tuple[str, str]],
+                         summary: str, upto: int):
+        """Ask the fast model for an updated summary and store it on the conversation"""
+        try:
+            transcript = "\n".join(f"{'לקוח' if role == 'user' else 'נציג'}: {content}" for role, content in messages)
+            if summary:
+                transcript = f"סיכום קודם:\n{summary}\n\nהמשך השיחה:\n{transcript}"
+            request = {
+                'model': self.router.cheapest_model(),
+                'max_tokens': self.summary_max_tokens,
+                'system': SUMMARY_SYSTEM_PROMPT,
+                'messages': [{"role": "user", "content": transcript}]
+            }
+            with STAGE_LATENCY.time(stage="summary"):
+                response = await self._create_message_async(request)
+            if getattr(response, 'content', None):
+                await db.save_summary(conversation_id, response.content[0].text.strip(), upto)
+                logging.info(f"Conversation summary updated - Conversation ID: {conversation_id}, covers {upto} messages")
+        except Exception as e:
+            logging.error(f"Failed to summarize conversation: {str(e)}")
+        finally:
+            self._summarizing.discard(conversation_id)
+
+    @staticmethod
+    def _partial_usage(stream, raw_parts: List[str]) -> Tuple[int, int]:
+        """(input, output) tokens used by a cut-off stream; output falls back to the text delta count"""
+        try:
+            usage = stream.current_message_snapshot.usage
+        except Exception:
+            usage = None
+        input_tokens = getattr(usage, 'input_tokens', 0) or 0
+        output_tokens = max(getattr(usage, 'output_tokens', 0) or 0, len(raw_parts))
+        return input_tokens, output_tokens
+
+    async def stream_response(self, prompt: str, db_manager, conversation_id: str) -> AsyncIterator[str]:
+        """Stream the answer for user prompt as text chunks.
+
+        Canned answers arrive as a single chunk. Claude answers are streamed token by
+        token, with the post-processing suffix (form links, legal disclaimer) sent as
+        the last chunk. The user message is saved before Claude is called and the
+        final answer once, after the stream ends. If the consumer stops early (the
+        generator is closed or cancelled) the Claude stream is closed and the turn
+        is saved as aborted with the text sent so far.
+        """
+        db = self._as_async_db(db_manager)
+        try:
+            logging.info(f"Streaming response for prompt: {prompt}")
+
+            quick_response = self._get_cached_response(prompt)
+            if quick_response:
+                await self._advance_qualification_async(db, conversation_id, prompt)
+            else:
+                quick_response, conversation_history = await self._get_rule_based_response_async(prompt, db, conversation_id)
+            if quick_response:
+                await db.save_exchange(conversation_id, prompt, quick_response)
+                await self._record_qualification_reply_async(db, conversation_id, quick_response)
+                yield quick_response
+                return
+
+            if conversation_history is None:
+                conversation_history = await db.get_conversation_history(conversation_id)
+            summary, summarized = await db.get_summary(conversation_id)
+            request = self._build_claude_request(prompt, conversation_history, summary, summarized)
+            cached = await self._lookup_response_cache(request)
+            if cached is not None:
+                bot_response = self._finalize_response(cached)
+                await db.save_exchange(conversation_id, prompt, bot_response, self.prompt_template.version)
+                await self._record_qualification_reply_async(db, conversation_id, bot_response)
+                yield bot_response
+                return
+
+            if self.llm.breaker.is_open():
+                bot_response = self._finalize_response(self._fallback_response(prompt, "circuit_open"))
+                await db.save_exchange(conversation_id, prompt, bot_response)
+                await self._record_qualification_reply_async(db, conversation_id, bot_response)
+                yield bot_response
+                return
+
+            raw_parts = []
+            final_message = None
+            model = request.get('model', '')
+            user_saved = False
+            stream = None
+            try:
+                async with self.admission.slot():
+                    # Set before awaiting: the write completes even if we are cancelled meanwhile
+                    user_saved = True
+                    await db.save_message(conversation_id, "user", prompt)
+                    started = time.perf_counter()
+                    try:
+                        async with self.llm.stream(self.async_client, request) as stream:
+                            async for text in stream.text_stream:
+                                if not raw_parts:
+                                    STAGE_LATENCY.observe(time.perf_counter() - started, stage="llm_first_token")
+                                raw_parts.append(text)
+                                yield text
+                            final_message = await stream.get_final_message()
+                            record_llm_usage(model, final_message)
+                    except (asyncio.CancelledError, GeneratorExit):
+                        # Leaving the stream context closed the connection, so Anthropic stops generating
+                        LLM_REQUESTS.inc(model=model, outcome="cancelled")
+                        record_llm_cancelled(model, *self._partial_usage(stream, raw_parts))
+                        raise
+                    except LLMUnavailable as e:
+                        # Raised before the first token, so a canned answer can stand in
+                        LLM_REQUESTS.inc(model=model, outcome="error")
+                        raw_parts = [self._fallback_response(prompt, e.reason)]
+                        yield raw_parts[0]
+                    except Exception:
+                        LLM_REQUESTS.inc(model=model, outcome="error")
+                        raise
+                    else:
+                        LLM_REQUESTS.inc(model=model, outcome="ok")
+                        STAGE_LATENCY.observe(time.perf_counter() - started, stage="llm")
+                        self.router.record_call(model, time.perf_counter() - started, final_message)
+
+                raw_response = "".join(raw_parts)
+                if raw_response and self._is_complete(final_message):
+                    self._store_response_cache(request, raw_response)
+                if not raw_response:
+                    raw_response = "מצטער, לא הצלחתי להבין. אנא נסה שוב."
+                    yield raw_response
+
+                # Post-processing only appends, so the client just needs the tail
+                bot_response = self._finalize_response(raw_response)
+                suffix = bot_response[len(raw_response):]
+                if suffix:
+                    yield suffix
+            except (asyncio.CancelledError, GeneratorExit):
+                # Client went away (or shutdown) mid-answer: keep what it was sent
+                self._abort_turn(db, conversation_id, "".join(raw_parts), None if user_saved else prompt)
+                raise
+
+            await db.save_reply(conversation_id, bot_response, self.prompt_template.version)
+            await self._record_qualification_reply_async(db, conversation_id, bot_response)
+            self._maybe_summarize(db, conversation_id, conversation_history, summary, summarized)
+
+        except OverloadedError:
+            raise
+        except Exception as e:
+            logging.error(f"Error in stream_response: {str(e)}")
+            yield ERROR_RESPONSE
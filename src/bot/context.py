@@ -1,25 +1,59 @@
-import yaml
 import logging
-import anthropic
 import os
-import re
-from typing import Dict, Optional, List, Tuple
+import time
+from typing import Dict, Optional, List, Sequence, Tuple
 from datetime import datetime
 from dotenv import load_dotenv
+from src.bot.fallback import FallbackResponder
+from src.bot.rules import RuleEngine
+from src.bot.prompts import PromptTemplate
+from src.bot.qualification import (QUALIFICATION_QUESTION, QualificationFlow, QualificationState, QUALIFIED,
+                                    NOT_QUALIFIED, UNCLEAR, UNKNOWN, ensure_qualification_columns,
+                                    read_qualification, write_qualification)
+from src.bot.resilience import LLMUnavailable, ResilientLLM
+from src.bot.routing import ModelRouter, RouteDecision
+from src.bot.token_budget import TokenBudget
+from src.utils.metrics import DB_OPERATIONS, LLM_FALLBACKS, LLM_REQUESTS, STAGE_LATENCY, record_cache_lookup, record_llm_usage
 
 # Load environment variables
 load_dotenv()
 
+# Reply returned to the user when the pipeline fails
+ERROR_RESPONSE = "מצטער, אירעה שגיאה. אנא נסה שוב."
+
+# Mark the stable system prompt prefix for Anthropic prompt caching
+PROMPT_CACHING = os.getenv('PROMPT_CACHING', 'true').lower() != 'false'
+
+# Heading of the rolling conversation summary slot in the system prompt
+SUMMARY_HEADING = "סיכום השיחה עד כה:"
+
 class BotContext:
     def __init__(self, config_path: str = 'config'):
         self.config_path = config_path
         self.config = self.load_knowledge_base()
+        self.prompt_template = self._compile_system_prompt()
+        self.router = ModelRouter(self.config.get('model_routing'))
+        self.token_budget = TokenBudget()
+        self.qualification = QualificationFlow(self.config.get('qualified_investor_flow'))
+        self._qualification_columns_ready = False
+
+        # Recent messages sent verbatim; older ones are folded into the conversation summary
+        self.history_window = int(os.getenv('HISTORY_WINDOW', 6))
+        self.summary_batch = int(os.getenv('HISTORY_SUMMARY_BATCH', 4))
         
-        # Initialize Anthropic client with API key from environment
-        self.client = anthropic.Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
+        # Initialize Anthropic client with API key from environment; the SDK is
+        # imported here, when the bot is built, rather than when the API boots
+        import anthropic
+        # Retries are done by self.llm, which also enforces the deadline and circuit breaker
+        self.client = anthropic.Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'), max_retries=0)
+        self.llm = ResilientLLM()
         logging.info("Anthropic client initialized successfully")
         
         self._load_responses_cache()
+        self.fallback = FallbackResponder(
+            self._fallback_candidates(),
+            default=self.config.get('sales_responses', {}).get('meeting_offer') or ERROR_RESPONSE
+        )
         
         logging.basicConfig(
             filename='muvne_bot.log',
@@ -33,12 +67,7 @@ class BotContext:
             'qualified_investor': f"{base_url}/forms/qualified-investor",
             'marketing_agreement': f"{base_url}/forms/marketing-agreement"
         }
-        
-        # Define keywords for returns questions
-        self.returns_keywords = [
-            'תשואה', 'תשואות', 'ריבית', 'קופון', 'רווח', 'רווחים', 
-            'החזר', 'אחוזים', 'תשלום תקופתי'
-        ]
+
         
         # Define qualified investor criteria
         self.qualified_investor_criteria = """
@@ -60,16 +89,40 @@ class BotContext:
                             patterns = response['pattern'].split('|')
                             for pattern in patterns:
                                 self.responses_cache[pattern.lower()] = response['response']
-        logging.info("Responses cache loaded successfully")
+        # One pass over a text finds every canned pattern and keyword rule; the first pattern in the file wins
+        self.rules = RuleEngine.from_config(self.config.get('compliance_rules'), list(self.responses_cache))
+        logging.info(f"Responses cache loaded successfully ({len(self.responses_cache)} patterns)")
+
+    def _fallback_candidates(self) -> List[Tuple[str, str]]:
+        """(matched text, answer) pairs served while Claude is unavailable"""
+        candidates = [(pattern, response) for pattern, response in self.responses_cache.items()]
+        sales_responses = self.config.get('sales_responses', {})
+        if isinstance(sales_responses, dict):
+            patterns = sales_responses.get('patterns') or {}
+            for key, value in sales_responses.items():
+                if isinstance(value, str):
+                    keywords = " ".join(patterns.get(key) or [])
+                    candidates.append((f"{keywords} {value}", value))
+        return candidates
+
+    def _fallback_response(self, prompt: str, reason: str) -> str:
+        """Closest canned answer for prompt while Claude is unavailable"""
+        LLM_FALLBACKS.inc(reason=reason)
+        logging.warning(f"Claude unavailable ({reason}), answering from canned content")
+        return self._with_greeting(self.fallback.respond(prompt))
 
     def load_knowledge_base(self) -> Dict:
         """Load configuration files"""
+        import yaml
         config = {}
         config_files = {
             'client_questionnaire': 'client_questionnaire.yaml',
             'company_info': 'company_info.yaml',
+            'compliance_rules': 'compliance_rules.yaml',
             'legal': 'legal.yaml',
+            'model_routing': 'model_routing.yaml',
             'products': 'products.yaml',
+            'qualified_investor_flow': 'qualified_investor_flow.yaml',
             'sales_responses': 'sales_responses.yaml'
         }
         
@@ -97,8 +150,8 @@ class BotContext:
             quick_response = self._get_cached_response(prompt)
             if quick_response:
                 logging.info("Using cached response")
-                db_manager.save_message(conversation_id, "user", prompt)
-                db_manager.save_message(conversation_id, "assistant", quick_response)
+                self._advance_qualification(db_manager, conversation_id, prompt)
+                self._save_exchange(db_manager, conversation_id, prompt, quick_response)
                 return quick_response
 
             # Handle special cases and get Claude response
@@ -106,34 +159,41 @@ class BotContext:
             
         except Exception as e:
             logging.error(f"Error in get_response: {str(e)}")
-            return "מצטער, אירעה שגיאה. אנא נסה שוב."
+            return ERROR_RESPONSE
 
     def _get_cached_response(self, prompt: str) -> Optional[str]:
         """Get response from cache if available"""
+        with STAGE_LATENCY.time(stage="cache_lookup"):
+            response = self._lookup_cached_response(prompt)
+        record_cache_lookup("patterns", response is not None)
+        return response
+
+    def _lookup_cached_response(self, prompt: str) -> Optional[str]:
+        """Find a canned answer whose pattern occurs in the prompt"""
         try:
-            prompt_lower = prompt.lower()
-            
-            # Add time-sensitive greeting
-            hour = datetime.now().hour
-            greeting = (
-                "בוקר טוב" if 5 <= hour < 12
-                else "צהריים טובים" if 12 <= hour < 17
-                else "ערב טוב" if 17 <= hour < 21
-                else "לילה טוב"
-            )
-
-            for pattern, response in self.responses_cache.items():
-                if pattern in prompt_lower:
-                    return response.replace('DYNAMIC_GREETING', greeting)
-                    
-            return None
+            index = self.rules.scan(prompt).canned
+            if index is None:
+                return None
+            return self._with_greeting(self.responses_cache[self.rules.canned_patterns[index]])
         except Exception as e:
             logging.error(f"Error in cached response: {str(e)}")
             return None
 
+    @staticmethod
+    def _with_greeting(response: str) -> str:
+        """Replace the DYNAMIC_GREETING placeholder with a time-sensitive greeting"""
+        hour = datetime.now().hour
+        greeting = (
+            "בוקר טוב" if 5 <= hour < 12
+            else "צהריים טובים" if 12 <= hour < 17
+            else "ערב טוב" if 17 <= hour < 21
+            else "לילה טוב"
+        )
+        return response.replace('DYNAMIC_GREETING', greeting)
+
     def is_question_requires_qualification(self, question: str) -> bool:
         """Check if question requires investor qualification"""
-        return any(term in question.lower() for term in self.returns_keywords)
+        return self.rules.matches(question, 'returns_question')
 
     def get_qualification_check_response(self) -> str:
         """Response for returns-related questions"""
@@ -174,47 +234,83 @@ class BotContext:
             האם יש משהו נוסף שתרצה לדעת על תהליך ההתקשרות? 🤝
             """
 
+    def is_agreement_request(self, text: str) -> bool:
+        """Check if user asks about the engagement agreement"""
+        return self.rules.matches(text, 'agreement_request')
+
+    def _get_qualification_response(self, state: QualificationState) -> Tuple[bool, Optional[str]]:
+        """Resolve the qualified investor flow for a returns question.
+
+        state already includes the current message. Returns (handled, response).
+        handled=False falls through to the other rules, handled=True with no
+        response means Claude should answer directly.
+        """
+        if state.status == UNKNOWN:
+            return True, self.get_qualification_check_response()
+        if state.status == QUALIFIED:
+            return True, self.handle_investor_response(True)
+        if state.status == NOT_QUALIFIED:
+            return True, self.handle_investor_response(False)
+        # Continue with normal response if no clear answer
+        if state.status == UNCLEAR:
+            return True, None
+        return False, None
+
+    def _ensure_qualification_columns(self, conn):
+        if not self._qualification_columns_ready:
+            ensure_qualification_columns(conn)
+            conn.commit()
+            self._qualification_columns_ready = True
+
+    def _advance_qualification(self, db_manager, conversation_id: str, prompt: str) -> QualificationState:
+        """Apply the user's message to the stored qualification state, saving it if it changed.
+
+        Conversations without a stored state get it once from their history.
+        """
+        conn = db_manager.get_connection()
+        try:
+            self._ensure_qualification_columns(conn)
+            stored = read_qualification(conn, conversation_id)
+            state = stored or self.qualification.replay(self._load_history(db_manager, conversation_id))
+            state = self.qualification.on_message(state, 'user', prompt)
+            if state != stored:
+                write_qualification(conn, conversation_id, state)
+            return state
+        finally:
+            conn.close()
+
+    def _record_qualification_reply(self, db_manager, conversation_id: str, response: str):
+        """Apply a saved assistant reply to the stored state: Asked once it asks the qualification question"""
+        if not self.qualification.asks(response):
+            return
+        conn = db_manager.get_connection()
+        try:
+            self._ensure_qualification_columns(conn)
+            state = read_qualification(conn, conversation_id) or QualificationState()
+            next_state = self.qualification.on_message(state, 'assistant', response)
+            if next_state != state:
+                write_qualification(conn, conversation_id, next_state)
+        finally:
+            conn.close()
+
     def _get_claude_response(self, prompt: str, db_manager, conversation_id: str) -> str:
         """Get response from Claude API with enhanced logic"""
         try:
+            state = self._advance_qualification(db_manager, conversation_id, prompt)
+
             # Check if question is about returns
             if self.is_question_requires_qualification(prompt):
-                conversation_history = db_manager.get_conversation_history(conversation_id)
-                
-                # Check if we already asked about qualified investor
-                already_asked = any("האם אתה משקיע כשיר" in msg[1] 
-                                  for msg in conversation_history 
-                                  if msg[0] == 'assistant')
-                
-                if not already_asked:
-                    response = self.get_qualification_check_response()
-                    db_manager.save_message(conversation_id, "user", prompt)
-                    db_manager.save_message(conversation_id, "assistant", response)
-                    return response
-                
-                # Check if we got an answer to the qualified investor question
-                last_question_index = max(i for i, msg in enumerate(conversation_history) 
-                                        if msg[0] == 'assistant' and "האם אתה משקיע כשיר" in msg[1])
-                
-                if last_question_index < len(conversation_history) - 1:
-                    user_response = conversation_history[last_question_index + 1][1].lower()
-                    if "כן" in user_response:
-                        response = self.handle_investor_response(True)
-                    elif "לא" in user_response:
-                        response = self.handle_investor_response(False)
-                    else:
-                        # Continue with normal response if no clear answer
+                handled, response = self._get_qualification_response(state)
+                if handled:
+                    if response is None:
                         return self._get_normal_claude_response(prompt, db_manager, conversation_id)
-                        
-                    db_manager.save_message(conversation_id, "user", prompt)
-                    db_manager.save_message(conversation_id, "assistant", response)
+                    self._save_exchange(db_manager, conversation_id, prompt, response)
                     return response
             
             # Check for agreement request
-            if any(word in prompt.lower() for word in ['הסכם', 'חוזה', 'התקשרות']):
+            if self.is_agreement_request(prompt):
                 response = self.handle_investor_response(False)  # Use same function for agreement info
-                db_manager.save_message(conversation_id, "user", prompt)
-                db_manager.save_message(conversation_id, "assistant", response)
+                self._save_exchange(db_manager, conversation_id, prompt, response)
                 return response
             
             # Default to normal Claude response
@@ -222,40 +318,146 @@ class BotContext:
             
         except Exception as e:
             logging.error(f"Error in _get_claude_response: {str(e)}")
-            return "מצטער, אירעה שגיאה. אנא נסה שוב."
+            return ERROR_RESPONSE
 
     def _get_normal_claude_response(self, prompt: str, db_manager, conversation_id: str) -> str:
         """Get standard response from Claude"""
         try:
-            # Prepare system prompt
-            system_prompt = self._get_system_prompt()
-            
             # Get response from Claude
-            response = self.client.messages.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="claude-3-opus-20240229",
-                max_tokens=800,
-                system=system_prompt
-            )
-            
-            bot_response = response.content[0].text if hasattr(response, 'content') else "מצטער, לא הצלחתי להבין. אנא נסה שוב."
-            
-            # Add legal disclaimer if needed
-            if self._needs_legal_disclaimer(bot_response):
-                bot_response = self._add_legal_disclaimer(bot_response)
+            conversation_history = self._load_history(db_manager, conversation_id)
+            try:
+                response = self._create_message(self._build_claude_request(prompt, conversation_history))
+                bot_response = self._extract_text(response)
+            except LLMUnavailable as e:
+                bot_response = self._fallback_response(prompt, e.reason)
+            bot_response = self._finalize_response(bot_response)
             
             # Save messages
-            db_manager.save_message(conversation_id, "user", prompt)
-            db_manager.save_message(conversation_id, "assistant", bot_response)
+            self._save_exchange(db_manager, conversation_id, prompt, bot_response)
             
             return bot_response
             
         except Exception as e:
             logging.error(f"Claude API error: {str(e)}")
-            return "מצטער, אירעה שגיאה. אנא נסה שוב."
+            return ERROR_RESPONSE
+
+    def _load_history(self, db_manager, conversation_id: str) -> List[Tuple[str, str]]:
+        """Read conversation history, timed and counted for /metrics"""
+        DB_OPERATIONS.inc(operation="get_history")
+        with STAGE_LATENCY.time(stage="db_history"):
+            return db_manager.get_conversation_history(conversation_id)
+
+    def _save_exchange(self, db_manager, conversation_id: str, prompt: str, response: str):
+        """Save a user/assistant pair, timed and counted for /metrics, and apply the reply to the qualification state"""
+        DB_OPERATIONS.inc(2, operation="save_message")
+        with STAGE_LATENCY.time(stage="db_save"):
+            db_manager.save_message(conversation_id, "user", prompt)
+            db_manager.save_message(conversation_id, "assistant", response)
+        self._record_qualification_reply(db_manager, conversation_id, response)
+
+    def _create_message(self, request: Dict):
+        """Call Claude with the sync client, recording latency and token usage"""
+        model = request.get('model', '')
+        started = time.perf_counter()
+        try:
+            with STAGE_LATENCY.time(stage="llm"):
+                response = self.llm.create(self.client, request)
+        except Exception:
+            LLM_REQUESTS.inc(model=model, outcome="error")
+            raise
+        LLM_REQUESTS.inc(model=model, outcome="ok")
+        record_llm_usage(model, response)
+        self.router.record_call(model, time.perf_counter() - started, response)
+        return response
+
+    def _route_turn(self, prompt: str, conversation_history: Optional[List[Tuple[str, str]]] = None,
+                    retrieved: int = 0) -> RouteDecision:
+        """Pick the model for a turn from cheap local features"""
+        history = conversation_history or []
+        last_assistant = next((msg[1] for msg in reversed(history) if msg[0] == 'assistant'), "")
+        return self.router.decide({
+            'length': len(prompt),
+            'keyword_hits': self.router.keyword_hits(prompt),
+            'qualification': self.is_question_requires_qualification(prompt) or QUALIFICATION_QUESTION in last_assistant,
+            'retrieved': retrieved,
+            'history': len(history)
+        })
+
+    def _build_claude_request(self, prompt: str, conversation_history: Optional[List[Tuple[str, str]]] = None,
+                              summary: str = "", summarized: int = 0) -> Dict:
+        """Build the messages.create arguments for a standard answer.
+
+        The first summarized messages of conversation_history are covered by
+        summary; the recent ones after them are sent as earlier turns.
+        """
+        route = self._route_turn(prompt, conversation_history)
+        _, recent = self._pack_prompt(prompt, history=self._recent_history(conversation_history, summarized),
+                                      summary=summary)
+        return {
+            'messages': self._history_messages(recent) + [{"role": "user", "content": prompt}],
+            'model': route.model,
+            'max_tokens': route.max_tokens,
+            'system': self.prompt_template.render(cache=PROMPT_CACHING, summary=summary)
+        }
+
+    def _recent_history(self, conversation_history: Optional[List[Tuple[str, str]]],
+                        summarized: int = 0) -> List[Tuple[str, str]]:
+        """Messages not covered by the summary, at most the window plus one summary batch"""
+        return list(conversation_history or [])[summarized:][-(self.history_window + self.summary_batch):]
+
+    @staticmethod
+    def _history_messages(history: Sequence[Tuple[str, str]]) -> List[Dict]:
+        """Earlier turns as alternating user/assistant messages.
+
+        Empty messages are skipped and consecutive ones from the same side merged;
+        the list starts with a user turn and ends with an assistant one, so the
+        current prompt can follow it.
+        """
+        messages = []
+        for role, content in history:
+            if role not in ('user', 'assistant') or not content or not content.strip():
+                continue
+            if messages and messages[-1]['role'] == role:
+                messages[-1]['content'] += f"\n\n{content}"
+            else:
+                messages.append({"role": role, "content": content})
+        while messages and messages[0]['role'] != 'user':
+            messages.pop(0)
+        # A question left unanswered (e.g. the turn failed) is usually asked again now
+        if messages and messages[-1]['role'] == 'user':
+            messages.pop()
+        return messages
+
+    def _pack_prompt(self, prompt: str, documents: Sequence[str] = (),
+                     history: Sequence[Tuple[str, str]] = (), summary: str = "") -> Tuple[List[str], List[Tuple[str, str]]]:
+        """Fit retrieved documents, then history (newest first), into the prompt token budget.
+
+        Returns the kept documents and (role, content) history, history in chronological order.
+        """
+        newest_first = list(reversed(history))
+        kept, _ = self.token_budget.pack(
+            {'system': self.prompt_template.stable, 'summary': summary, 'prompt': prompt},
+            [('documents', list(documents)), ('history', [content for _, content in newest_first])]
+        )
+        kept_history = [(role, content) for (role, _), content in zip(newest_first, kept['history'])]
+        return kept['documents'], list(reversed(kept_history))
+
+    def _compile_system_prompt(self) -> PromptTemplate:
+        """Compile the system prompt once per config load.
+
+        Anthropic caches the stable text up to its cache breakpoint, so the long
+        company and product text is billed at the cache-read rate on later calls.
+        """
+        return PromptTemplate("sales", self._get_system_prompt(), slots=(("summary", SUMMARY_HEADING),))
+
+    def _extract_text(self, response) -> str:
+        """Get the answer text out of a Claude response"""
+        if getattr(response, 'content', None):
+            return response.content[0].text
+        return "מצטער, לא הצלחתי להבין. אנא נסה שוב."
 
     def _get_system_prompt(self) -> str:
-        """Get system prompt from config"""
+        """Render the system prompt text from config; called when compiling the template"""
         company_info = self.config.get('company_info', {})
         products_info = self.config.get('products', {})
         
@@ -274,13 +476,30 @@ class BotContext:
         4. היה ידידותי אך מקצועי
         5. תן תשובות מעמיקות המעידות על הבנה פיננסית"""
 
+    def add_form_links_if_needed(self, response: str) -> str:
+        """Add form links if relevant"""
+        classes = self.rules.scan(response).classes
+        if 'agreement_form_link' in classes:
+            response += f"\n\nקישור להסכם שיווק השקעות: {self.forms_urls['marketing_agreement']}"
+        
+        if 'qualified_investor_form_link' in classes:
+            response += f"\n\nקישור להצהרת משקיע כשיר: {self.forms_urls['qualified_investor']}"
+        
+        return response
+
+    def _finalize_response(self, bot_response: str) -> str:
+        """Apply post-processing to a raw Claude answer before it is saved"""
+        # Form links go before the legal disclaimer, which closes the answer
+        bot_response = self.add_form_links_if_needed(bot_response)
+
+        # Add legal disclaimer if needed
+        if self._needs_legal_disclaimer(bot_response):
+            bot_response = self._add_legal_disclaimer(bot_response)
+        return bot_response
+
     def _needs_legal_disclaimer(self, text: str) -> bool:
         """Check if response needs legal disclaimer"""
-        terms_requiring_disclaimer = [
-            'תשואה', 'ריבית', 'רווח', 'החזר',
-            'השקעה', 'סיכון', 'הגנה', 'קרן'
-        ]
-        return any(term in text for term in terms_requiring_disclaimer)
+        return self.rules.matches(text, 'needs_disclaimer')
 
     def _add_legal_disclaimer(self, text: str) -> str:
         """Add legal disclaimer to response"""
@@ -290,15 +509,7 @@ class BotContext:
 
     def contains_restricted_info(self, text: str) -> bool:
         """Check if text contains restricted information"""
-        restricted_patterns = [
-            r'\d+%',  # Any percentage
-            r'קופון של',
-            r'תשואה של',
-            r'ריבית של',
-            r'החזר של',
-            r'רווח של'
-        ]
-        return any(re.search(pattern, text) for pattern in restricted_patterns)
+        return self.rules.matches(text, 'restricted_info')
 
     def get_conversation_context(self, conversation_history: List[Tuple[str, str]]) -> str:
         """Get relevant context from conversation history"""
@@ -313,15 +524,13 @@ class BotContext:
     def format_response(self, response: str) -> str:
         """Format the response with proper styling and structure"""
         try:
-            # Add emojis based on content
-            if 'פגישה' in response:
-                response += ' 📅'
-            elif 'מייל' in response:
-                response += ' 📧'
-            elif 'השקעה' in response:
-                response += ' 📈'
-            elif 'חתימה' in response or 'הסכם' in response:
-                response += ' 📝'
+            # Add emojis based on content, first matching class wins
+            classes = self.rules.scan(response).classes
+            for rule_class, emoji in (('meeting_mention', ' 📅'), ('email_mention', ' 📧'),
+                                      ('investment_mention', ' 📈'), ('signature_mention', ' 📝')):
+                if rule_class in classes:
+                    response += emoji
+                    break
                 
             return response
 
@@ -0,0 +1,46 @@
+import logging
+import os
+from typing import Iterable, List, Optional, Tuple
+from src.bot.response_cache import normalize_prompt
+
+
+def word_trigrams(text: str) -> set:
+    """Trigrams inside words of three letters or more, so short function words and word gaps do not match"""
+    return {word[i:i + 3] for word in normalize_prompt(text).split() if len(word) >= 3
+            for i in range(len(word) - 2)}
+
+
+def _clean(answer: str) -> str:
+    return "\n".join(line.strip() for line in answer.strip().splitlines())
+
+
+class FallbackResponder:
+    """Closest canned answer for a question, used while Claude is unavailable.
+
+    Candidates are (text, answer) pairs: the text (patterns plus answer, or a
+    knowledge block) is what the question is compared against. The score is
+    the share of the question's word trigrams found in the candidate text; below
+    min_score the default answer is returned.
+    """
+
+    def __init__(self, candidates: Iterable[Tuple[str, str]], default: str, min_score: Optional[float] = None):
+        self.default = default
+        self.min_score = min_score if min_score is not None else float(os.getenv('LLM_FALLBACK_MIN_SCORE', 0.5))
+        self._candidates: List[Tuple[set, str]] = [
+            (word_trigrams(text), _clean(answer)) for text, answer in candidates if answer and answer.strip()
+        ]
+
+    def respond(self, prompt: str) -> str:
+        grams = word_trigrams(prompt)
+        best_answer, best_score = None, 0.0
+        for candidate_grams, answer in self._candidates:
+            score = len(grams & candidate_grams) / len(grams) if grams else 0.0
+            if score > best_score:
+                best_answer, best_score = answer, score
+        if best_answer is None or best_score < self.min_score:
+            return self.default
+        logging.info(f"Fallback answer matched with score {best_score:.2f}")
+        return best_answer
+
+    def __len__(self) -> int:
+        return len(self._candidates)
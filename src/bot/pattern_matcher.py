@@ -0,0 +1,71 @@
+from collections import deque
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+
+class PatternMatcher:
+    """Aho-Corasick automaton finding many substring patterns in one pass over the text.
+
+    Patterns are matched as plain substrings, so callers normalise case
+    themselves. Matches are reported by pattern index; callers that want
+    the first listed pattern to win pick the lowest. Empty patterns are
+    ignored.
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns: List[str] = list(patterns)
+        self._goto: List[Dict[str, int]] = [{}]
+        # Pattern indexes ending at each node, and the nearest node down the failure chain that has some
+        self._out: List[List[int]] = [[]]
+        self._fail: List[int] = [0]
+        self._dict_link: List[int] = [0]
+
+        for index, pattern in enumerate(self.patterns):
+            if pattern:
+                self._add(pattern, index)
+        self._link()
+
+    def _add(self, pattern: str, index: int):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._out.append([])
+                self._fail.append(0)
+                self._dict_link.append(0)
+            node = next_node
+        self._out[node].append(index)
+
+    def _link(self):
+        """Breadth-first pass setting failure links and dictionary links"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            fail = self._fail[node]
+            self._dict_link[node] = fail if self._out[fail] else self._dict_link[fail]
+            for char, child in self._goto[node].items():
+                state = fail
+                while char not in self._goto[state] and state:
+                    state = self._fail[state]
+                target = self._goto[state].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                queue.append(child)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """(end offset, pattern index) for every occurrence, in text order"""
+        goto, fail, out, dict_link = self._goto, self._fail, self._out, self._dict_link
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            node = state
+            while node:
+                for index in out[node]:
+                    yield position + 1, index
+                node = dict_link[node]
+
+    def __len__(self) -> int:
+        return len(self.patterns)
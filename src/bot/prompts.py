@@ -0,0 +1,48 @@
+import hashlib
+import logging
+from typing import Dict, List, Sequence, Tuple
+
+
+class PromptTemplate:
+    """System prompt compiled once from config, with named slots filled per request.
+
+    The stable text is rendered when the config is loaded; render() only adds
+    the non-empty volatile slots after it, each under its heading. The version
+    is a hash of everything fixed at compile time, so it changes whenever the
+    prompt wording or the knowledge it embeds changes.
+    """
+
+    __slots__ = ('name', 'stable', 'slots', 'version')
+
+    def __init__(self, name: str, stable: str, slots: Sequence[Tuple[str, str]] = ()):
+        digest = hashlib.sha256(name.encode('utf-8'))
+        digest.update(stable.encode('utf-8'))
+        for slot, heading in slots:
+            digest.update(f"\n{slot}:{heading}".encode('utf-8'))
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'stable', stable)
+        object.__setattr__(self, 'slots', tuple(slots))
+        object.__setattr__(self, 'version', digest.hexdigest()[:12])
+        logging.info(f"Compiled system prompt '{name}' version {self.version}")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PromptTemplate is immutable")
+
+    def volatile_text(self, **values: str) -> str:
+        """Filled slots in template order, each under its heading"""
+        unknown = set(values) - {slot for slot, _ in self.slots}
+        if unknown:
+            raise KeyError(f"Unknown prompt slots: {', '.join(sorted(unknown))}")
+        sections = [f"{heading}\n{values[slot]}" for slot, heading in self.slots if values.get(slot)]
+        return "\n\n".join(sections)
+
+    def render(self, cache: bool = True, **values: str) -> List[Dict]:
+        """System prompt blocks: the stable text (a prompt-cache breakpoint when cache) then the slots"""
+        stable_block = {"type": "text", "text": self.stable}
+        if cache:
+            stable_block["cache_control"] = {"type": "ephemeral"}
+        blocks = [stable_block]
+        volatile = self.volatile_text(**values)
+        if volatile:
+            blocks.append({"type": "text", "text": volatile})
+        return blocks
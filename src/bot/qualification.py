@@ -0,0 +1,103 @@
+import sqlite3
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+# Question the bot asks before discussing returns; its reply is the next user message
+QUALIFICATION_QUESTION = "האם אתה משקיע כשיר"
+
+# conversations.investor_status values
+UNKNOWN = "Unknown"
+ASKED = "Asked"
+QUALIFIED = "Qualified"
+NOT_QUALIFIED = "Not Qualified"
+UNCLEAR = "Unclear"
+
+# Longest client reply stored as qualification_reason
+MAX_REASON_LENGTH = 200
+
+
+class QualificationState(NamedTuple):
+    status: str = UNKNOWN
+    # What decided the status: the matched answer option or the client's reply
+    reason: Optional[str] = None
+
+
+class QualificationFlow:
+    """The qualified investor flow as a state machine over a conversation's messages.
+
+    Unknown moves to Asked when the bot asks whether the client is a
+    qualified investor. The next user message answers it: one of the
+    options in qualified_investor_flow.yaml, or a plain yes or no, gives
+    Qualified or Not Qualified, anything else Unclear. Asking again goes back
+    to Asked. The state is stored on the conversation, so a turn reads it
+    instead of rescanning the history.
+    """
+
+    def __init__(self, flow_config: Optional[Dict] = None):
+        self.options: List[Tuple[str, bool]] = []
+        for question in (flow_config or {}).get('initial_questions') or []:
+            for option in question.get('options') or []:
+                if option.get('text') and 'qualifies' in option:
+                    self.options.append((str(option['text']).lower(), bool(option['qualifies'])))
+
+    def answer(self, reply: str) -> QualificationState:
+        """State after the client replied to the qualification question"""
+        text = reply.lower()
+        for option, qualifies in self.options:
+            if option in text:
+                return QualificationState(QUALIFIED if qualifies else NOT_QUALIFIED, option)
+        reason = reply.strip()[:MAX_REASON_LENGTH]
+        if "כן" in text:
+            return QualificationState(QUALIFIED, reason)
+        if "לא" in text:
+            return QualificationState(NOT_QUALIFIED, reason)
+        return QualificationState(UNCLEAR, reason)
+
+    @staticmethod
+    def asks(content: str) -> bool:
+        """Whether an assistant message asks the qualification question, the only reply that moves the state"""
+        return QUALIFICATION_QUESTION in content
+
+    def on_message(self, state: QualificationState, role: str, content: str) -> QualificationState:
+        """Transition for one message added to the conversation"""
+        if role == 'assistant':
+            return QualificationState(ASKED) if self.asks(content) else state
+        return self.answer(content) if state.status == ASKED else state
+
+    def replay(self, conversation_history: Sequence[Tuple[str, str]]) -> QualificationState:
+        """State of a conversation stored before investor_status was kept up to date"""
+        state = QualificationState()
+        for role, content in conversation_history:
+            state = self.on_message(state, role, content)
+        return state
+
+
+def ensure_qualification_columns(conn):
+    """Add the qualification columns to conversations if the schema lacks them; the caller commits"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(conversations)")]
+    for column in ("investor_status", "qualification_reason"):
+        if column not in columns:
+            try:
+                conn.execute(f"ALTER TABLE conversations ADD COLUMN {column} TEXT")
+            except sqlite3.OperationalError as e:
+                # Another worker added it between the PRAGMA and the ALTER
+                if "duplicate column" not in str(e):
+                    raise
+
+
+def read_qualification(conn, conversation_id: str) -> Optional[QualificationState]:
+    """Stored state, or None when the conversation has none yet"""
+    row = conn.execute(
+        "SELECT investor_status, qualification_reason FROM conversations WHERE conversation_id = ?",
+        (conversation_id,)
+    ).fetchone()
+    if not row or not row[0]:
+        return None
+    return QualificationState(row[0], row[1])
+
+
+def write_qualification(conn, conversation_id: str, state: QualificationState):
+    conn.execute(
+        "UPDATE conversations SET investor_status = ?, qualification_reason = ? WHERE conversation_id = ?",
+        (state.status, state.reason, conversation_id)
+    )
+    conn.commit()
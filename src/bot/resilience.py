@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from src.utils.metrics import LLM_RETRIES
+
+# HTTP statuses worth retrying: timeout, conflict, rate limit and every 5xx (529 is Anthropic's overloaded)
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class LLMUnavailable(Exception):
+    """Raised when Claude cannot answer: the circuit is open or every attempt failed"""
+
+    def __init__(self, reason: str, retry_after: int = 0):
+        super().__init__(f"Claude unavailable ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Transient upstream failure: connection problem, timeout, rate limit or server error"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    # Matched by name so the anthropic SDK is not imported here
+    if type(error).__name__ in ('APIConnectionError', 'APITimeoutError'):
+        return True
+    status = getattr(error, 'status_code', None)
+    return isinstance(status, int) and (status in RETRYABLE_STATUS or status >= 500)
+
+
+class CircuitBreaker:
+    """Stops calling Claude after failure_threshold consecutive failed attempts.
+
+    While open every call fails fast. After reset_timeout seconds the breaker
+    is half-open and lets a single trial call through while the others keep
+    failing fast: its success closes the breaker, its failure opens it for
+    another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.failure_threshold = failure_threshold or int(os.getenv('LLM_BREAKER_FAILURES', 5))
+        self.reset_timeout = reset_timeout or float(os.getenv('LLM_BREAKER_RESET', 30))
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        # Set while the half-open trial call runs
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """True while calls are refused, without moving to half-open"""
+        if self.state == "half_open":
+            return self._probing
+        return self.state == "open" and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def admit(self) -> Optional[str]:
+        """State a new call is let through in ("closed", or "half_open" for the trial call), or None if refused"""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return None
+                self.state = "half_open"
+                logging.info("LLM circuit half-open, trying Claude again")
+            if self.state == "half_open":
+                if self._probing:
+                    return None
+                self._probing = True
+            return self.state
+
+    def allow(self) -> bool:
+        return self.admit() is not None
+
+    def release(self, admitted: Optional[str]):
+        """End a call admitted by admit(); frees the trial slot if it recorded neither success nor failure"""
+        if admitted == "half_open":
+            with self._lock:
+                self._probing = False
+
+    def retry_after(self) -> int:
+        return max(1, int(self.reset_timeout - (time.monotonic() - self._opened_at)))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logging.info("LLM circuit closed")
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened += 1
+                self._opened_at = time.monotonic()
+                logging.warning(f"LLM circuit open after {self.failures} consecutive failures, "
+                                f"retrying in {self.reset_timeout:.0f}s")
+
+    def stats(self) -> Dict:
+        return {'state': "open" if self.is_open() else self.state, 'consecutive_failures': self.failures,
+                'times_opened': self.opened}
+
+
+class ResilientLLM:
+    """Deadline, jittered retries and a circuit breaker around messages.create and messages.stream.
+
+    A call gets deadline seconds in total. Transient failures are retried up
+    to retries times with full-jitter exponential backoff, as long as the
+    backoff still fits before the deadline. The SDK's own retries should be
+    disabled (max_retries=0) on clients used here.
+    """
+
+    def __init__(self, deadline: Optional[float] = None, retries: Optional[int] = None,
+                 backoff: Optional[float] = None, max_backoff: Optional[float] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.deadline = deadline or float(os.getenv('LLM_DEADLINE', 45))
+        self.retries = retries if retries is not None else int(os.getenv('LLM_RETRIES', 2))
+        self.backoff = backoff or float(os.getenv('LLM_RETRY_BACKOFF', 0.5))
+        self.max_backoff = max_backoff or float(os.getenv('LLM_RETRY_MAX_BACKOFF', 4))
+        self.breaker = breaker or CircuitBreaker()
+
+    def _admit(self) -> str:
+        admitted = self.breaker.admit()
+        if admitted is None:
+            raise LLMUnavailable("circuit_open", self.breaker.retry_after())
+        return admitted
+
+    def _next_delay(self, attempt: int, error: BaseException, started: float, model: str) -> Optional[float]:
+        """Backoff before retrying after a failed attempt, or None to give up"""
+        if not is_retryable(error):
+            return None
+        self.breaker.record_failure()
+        if attempt >= self.retries or self.breaker.is_open():
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if time.monotonic() + delay >= started + self.deadline:
+            return None
+        LLM_RETRIES.inc(model=model)
+        logging.warning(f"Claude attempt {attempt + 1} failed ({type(error).__name__}: {str(error)}), "
+                        f"retrying in {delay:.2f}s")
+        return delay
+
+    def _remaining(self, started: float) -> float:
+        return max(0.1, started + self.deadline - time.monotonic())
+
+    def create(self, client, request: Dict):
+        """Blocking messages.create with retries"""
+        admitted = self._admit()
+        try:
+            model = request.get('model', '')
+            started = time.monotonic()
+            attempt = 0
+            while True:
+                try:
+                    response = client.messages.create(**request, timeout=self._remaining(started))
+                except Exception as e:
+                    delay = self._next_delay(attempt, e, started, model)
+                    if delay is None:
+                        if is_retryable(e):
+                            raise LLMUnavailable("failed") from e
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self.breaker.record_success()
+                return response
+        finally:
+            self.breaker.release(admitted)
+
+    async def create_async(self, client, request: Dict):
+        """messages.create on the async client with retries; a hung attempt is abandoned at the deadline"""
+        admitted = self._admit()
+        try:
+            model = request.get('model', '')
+            started = time.monotonic()
+            attempt = 0
+            while True:
+                remaining = self._remaining(started)
+                try:
+                    response = await asyncio.wait_for(client.messages.create(**request, timeout=remaining), remaining)
+                except Exception as e:
+                    delay = self._next_delay(attempt, e, started, model)
+                    if delay is None:
+                        if is_retryable(e):
+                            raise LLMUnavailable("failed") from e
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self.breaker.record_success()
+                return response
+        finally:
+            self.breaker.release(admitted)
+
+    @asynccontextmanager
+    async def stream(self, client, request: Dict):
+        """messages.stream that retries opening the stream; failures after the first event are not retried"""
+        admitted = self._admit()
+        try:
+            model = request.get('model', '')
+            started = time.monotonic()
+            attempt = 0
+            while True:
+                manager = client.messages.stream(**request, timeout=self._remaining(started))
+                try:
+                    stream = await manager.__aenter__()
+                except Exception as e:
+                    delay = self._next_delay(attempt, e, started, model)
+                    if delay is None:
+                        if is_retryable(e):
+                            raise LLMUnavailable("failed") from e
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                break
+
+            try:
+                yield stream
+            except BaseException as e:
+                if isinstance(e, Exception) and is_retryable(e):
+                    self.breaker.record_failure()
+                await manager.__aexit__(type(e), e, e.__traceback__)
+                raise
+            else:
+                await manager.__aexit__(None, None, None)
+                self.breaker.record_success()
+        finally:
+            self.breaker.release(admitted)
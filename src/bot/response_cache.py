@@ -0,0 +1,324 @@
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, Optional, Set, Tuple
+from src.utils.lifecycle import lifecycle
+from src.utils.metrics import CACHE_LOOKUPS
+
+# Hebrew points and cantillation marks
+NIQQUD = re.compile('[\u0591-\u05C7]')
+FINAL_LETTERS = str.maketrans('ךםןףץ', 'כמנפצ')
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+# Files whose change invalidates every cached answer
+DEFAULT_KNOWLEDGE_SOURCES = ('config/*.yaml', 'knowledge/**/*', 'database/documents.db')
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold a question to the form used as cache key: no niqqud, punctuation or final letters"""
+    text = unicodedata.normalize('NFKC', prompt).lower()
+    text = NIQQUD.sub('', text)
+    text = text.translate(FINAL_LETTERS)
+    text = PUNCTUATION.sub(' ', text)
+    return ' '.join(text.split())
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def knowledge_fingerprint(patterns: Iterable[str]) -> str:
+    """Hash of the path, size and mtime of every file matching patterns"""
+    digest = hashlib.sha256()
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                digest.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class _Entry:
+    __slots__ = ('namespace', 'normalized', 'grams', 'response', 'expires_at')
+
+    def __init__(self, namespace: str, normalized: str, response: str, expires_at: float):
+        self.namespace = namespace
+        self.normalized = normalized
+        self.grams = trigrams(normalized)
+        self.response = response
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """Claude answers keyed on the normalised question and the rest of the request.
+
+    The namespace hashes everything in the request except the final user
+    message (system prompt, model, parameters, earlier turns) together with
+    a fingerprint of config/*.yaml and the document knowledge, so an answer is
+    only reused for the same context, and editing the knowledge invalidates
+    everything. Lookups hit an in-memory LRU first; SQLite keeps answers
+    across restarts and is read once per namespace. Only first-turn requests
+    go to SQLite: a namespace that includes earlier turns belongs to one
+    conversation and is almost never asked again, so it stays in memory.
+    Expired and outdated rows are purged in the background when the
+    knowledge changes and every purge_interval seconds. Questions whose
+    trigram Jaccard similarity to a cached one reaches the threshold reuse
+    its answer.
+    """
+
+    def __init__(self, db_manager, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 similarity: Optional[float] = None, knowledge_sources: Iterable[str] = DEFAULT_KNOWLEDGE_SOURCES,
+                 version_check_interval: Optional[float] = None):
+        self.db_manager = db_manager
+        self.ttl = ttl or float(os.getenv('RESPONSE_CACHE_TTL', 86400))
+        self.max_entries = max_entries or int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 2000))
+        self.similarity = similarity if similarity is not None else float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0.9))
+        self.knowledge_sources = tuple(knowledge_sources)
+        self.version_check_interval = (version_check_interval if version_check_interval is not None
+                                       else float(os.getenv('RESPONSE_CACHE_VERSION_CHECK', 30)))
+        self.purge_interval = float(os.getenv('RESPONSE_CACHE_PURGE_INTERVAL', 3600))
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._index: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+        self._loaded_namespaces: Set[str] = set()
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._version: Optional[str] = None
+        self._version_checked_at = 0.0
+        self._purged_version: Optional[str] = None
+        self._purged_at = 0.0
+
+    # Keys
+
+    def knowledge_version(self) -> str:
+        """Current knowledge fingerprint, re-read at most every version_check_interval seconds"""
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked_at >= self.version_check_interval:
+            version = knowledge_fingerprint(self.knowledge_sources)
+            self._version_checked_at = now
+            if self._version is not None and version != self._version:
+                logging.info("Knowledge changed, clearing the response cache")
+                with self._lock:
+                    self._entries.clear()
+                    self._index.clear()
+                    self._loaded_namespaces.clear()
+            self._version = version
+        return self._version
+
+    @staticmethod
+    def _text(content) -> str:
+        if isinstance(content, str):
+            return content
+        return " ".join(block.get('text', '') for block in content if isinstance(block, dict))
+
+    def split_request(self, request: Dict) -> Tuple[str, str]:
+        """(namespace, normalised question) for a messages.create request"""
+        messages = request.get('messages') or []
+        context = {key: value for key, value in request.items() if key != 'messages'}
+        context['messages'] = messages[:-1]
+        context['knowledge_version'] = self.knowledge_version()
+        encoded = json.dumps(context, sort_keys=True, ensure_ascii=False, default=str)
+        namespace = hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+        question = self._text(messages[-1].get('content', '')) if messages else ''
+        return namespace, normalize_prompt(question)
+
+    @staticmethod
+    def _has_history(request: Dict) -> bool:
+        """Whether the request carries earlier turns of a conversation"""
+        return len(request.get('messages') or []) > 1
+
+    @staticmethod
+    def _key(namespace: str, normalized: str) -> str:
+        return hashlib.sha256(f"{namespace}\n{normalized}".encode('utf-8')).hexdigest()
+
+    # Memory tier
+
+    def _remember(self, key: str, entry: _Entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._unindex(key, old)
+            self._entries[key] = entry
+            index = self._index[entry.namespace]
+            for gram in entry.grams:
+                index[gram].add(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._unindex(evicted_key, evicted)
+
+    def _unindex(self, key: str, entry: _Entry):
+        index = self._index.get(entry.namespace)
+        if index is None:
+            return
+        for gram in entry.grams:
+            keys = index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[gram]
+
+    def _get_exact(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                self._unindex(key, entry)
+                return None
+            self._entries.move_to_end(key)
+            return entry.response
+
+    def _get_similar(self, namespace: str, normalized: str) -> Optional[str]:
+        """Best cached answer in namespace whose question is at least `similarity` alike"""
+        grams = trigrams(normalized)
+        with self._lock:
+            index = self._index.get(namespace)
+            if not index:
+                return None
+            overlaps: Dict[str, int] = defaultdict(int)
+            for gram in grams:
+                for key in index.get(gram, ()):
+                    overlaps[key] += 1
+
+            best_key, best_score = None, 0.0
+            now = time.time()
+            for key, overlap in overlaps.items():
+                entry = self._entries.get(key)
+                if entry is None or entry.expires_at <= now:
+                    continue
+                score = overlap / (len(grams) + len(entry.grams) - overlap)
+                if score > best_score:
+                    best_key, best_score = key, score
+            if best_key is None or best_score < self.similarity:
+                return None
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key].response
+
+    # SQLite tier
+
+    def _ensure_table(self, conn):
+        if self._table_ready:
+            return
+        conn.execute('''CREATE TABLE IF NOT EXISTS response_cache
+                     (cache_key TEXT PRIMARY KEY,
+                      namespace TEXT,
+                      knowledge_version TEXT,
+                      normalized_prompt TEXT,
+                      response TEXT,
+                      created_at REAL,
+                      expires_at REAL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_namespace ON response_cache (namespace)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at)')
+        conn.commit()
+        self._table_ready = True
+
+    def _load_namespace(self, namespace: str, version: str):
+        """Copy a namespace's live rows into memory"""
+        conn = self.db_manager.get_connection()
+        try:
+            self._ensure_table(conn)
+            rows = conn.execute('''SELECT normalized_prompt, response, expires_at FROM response_cache
+                                WHERE namespace = ? AND expires_at > ? AND knowledge_version = ?
+                                ORDER BY created_at DESC LIMIT ?''',
+                                (namespace, time.time(), version, self.max_entries)).fetchall()
+        finally:
+            conn.close()
+        for normalized, response, expires_at in reversed(rows):
+            self._remember(self._key(namespace, normalized), _Entry(namespace, normalized, response, expires_at))
+        if len(self._loaded_namespaces) >= self.max_entries:
+            # Prompt versions and models add up over time; dropped namespaces are just reloaded
+            self._loaded_namespaces.clear()
+        self._loaded_namespaces.add(namespace)
+
+    def _purge(self, version: str):
+        """Delete expired rows and rows cached for another knowledge version"""
+        conn = self.db_manager.get_connection()
+        try:
+            self._ensure_table(conn)
+            deleted = conn.execute('DELETE FROM response_cache WHERE expires_at <= ? OR knowledge_version != ?',
+                                   (time.time(), version)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        if deleted:
+            logging.info(f"Purged {deleted} stale cached responses")
+
+    def _maybe_purge(self, version: str):
+        """Start a background purge after a knowledge change or once purge_interval has passed"""
+        now = time.monotonic()
+        if version == self._purged_version and now - self._purged_at < self.purge_interval:
+            return
+        self._purged_version = version
+        self._purged_at = now
+        lifecycle.spawn(asyncio.to_thread(self._purge, version))
+
+    def _persist(self, key: str, entry: _Entry, version: str):
+        conn = self.db_manager.get_connection()
+        try:
+            self._ensure_table(conn)
+            conn.execute('''INSERT OR REPLACE INTO response_cache
+                         (cache_key, namespace, knowledge_version, normalized_prompt, response, created_at, expires_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         (key, entry.namespace, version, entry.normalized, entry.response,
+                          time.time(), entry.expires_at))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # Public API
+
+    async def lookup(self, request: Dict) -> Optional[str]:
+        """Cached answer text for request, or None"""
+        namespace, normalized = self.split_request(request)
+        if not normalized:
+            return None
+        key = self._key(namespace, normalized)
+        self._maybe_purge(self._version)
+
+        response = self._get_exact(key)
+        if response is None and not self._has_history(request) and namespace not in self._loaded_namespaces:
+            try:
+                await asyncio.to_thread(self._load_namespace, namespace, self._version)
+            except Exception as e:
+                logging.error(f"Failed to load response cache: {str(e)}")
+            response = self._get_exact(key)
+        result = "hit" if response is not None else "miss"
+
+        if response is None and self.similarity < 1:
+            response = self._get_similar(namespace, normalized)
+            if response is not None:
+                result = "similar"
+
+        CACHE_LOOKUPS.inc(cache="responses", result=result)
+        return response
+
+    async def store(self, request: Dict, response: str):
+        """Cache the answer text for request in memory, and in SQLite for first turns"""
+        namespace, normalized = self.split_request(request)
+        if not normalized or not response:
+            return
+        key = self._key(namespace, normalized)
+        entry = _Entry(namespace, normalized, response, time.time() + self.ttl)
+        self._remember(key, entry)
+        if self._has_history(request):
+            return
+        try:
+            await asyncio.to_thread(self._persist, key, entry, self._version)
+        except Exception as e:
+            logging.error(f"Failed to persist cached response: {str(e)}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
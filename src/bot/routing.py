@@ -0,0 +1,101 @@
+import logging
+import os
+from typing import Dict, List, NamedTuple, Optional
+from src.utils.metrics import LLM_COST, LLM_ROUTES, ROUTE_LATENCY
+
+# Used when config/model_routing.yaml is missing or names no routes
+FALLBACK_MODEL = "claude-3-opus-20240229"
+
+
+class RouteDecision(NamedTuple):
+    route: str
+    model: str
+    max_tokens: int
+    rule: str
+
+
+class ModelRouter:
+    """Pick the Claude model for a turn from the policy in config/model_routing.yaml.
+
+    Each turn is described by cheap local features (length, complex keyword
+    hits, qualification state, retrieved knowledge, history length); the first
+    rule whose conditions all hold picks the route, otherwise the default
+    route answers. MODEL_ROUTING=false sends every turn to the default route.
+    """
+
+    def __init__(self, policy: Optional[Dict] = None, enabled: Optional[bool] = None):
+        policy = policy or {}
+        self.routes: Dict[str, Dict] = dict(policy.get('routes') or {})
+        if not self.routes:
+            self.routes = {'default': {'model': FALLBACK_MODEL, 'max_tokens': 800}}
+        self.default_route = policy.get('default_route') or next(iter(self.routes))
+        if self.default_route not in self.routes:
+            raise ValueError(f"Unknown default route: {self.default_route}")
+
+        self.complex_keywords: List[str] = [keyword.lower() for keyword in policy.get('complex_keywords') or []]
+        self.rules: List[Dict] = []
+        for rule in policy.get('rules') or []:
+            if rule.get('route') not in self.routes:
+                raise ValueError(f"Rule {rule.get('name')} uses unknown route: {rule.get('route')}")
+            self.rules.append(rule)
+
+        self.enabled = enabled if enabled is not None else os.getenv('MODEL_ROUTING', 'true').lower() != 'false'
+        # Metrics only see the model id, so map it back to its route
+        self._route_by_model = {}
+        for name, route in self.routes.items():
+            self._route_by_model.setdefault(route['model'], name)
+
+    def keyword_hits(self, text: str) -> int:
+        text = text.lower()
+        return sum(1 for keyword in self.complex_keywords if keyword in text)
+
+    @staticmethod
+    def _matches(conditions: Dict, features: Dict) -> bool:
+        for key, expected in conditions.items():
+            if key.startswith('min_'):
+                if features.get(key[4:], 0) < expected:
+                    return False
+            elif key.startswith('max_'):
+                if features.get(key[4:], 0) > expected:
+                    return False
+            elif features.get(key) != expected:
+                return False
+        return True
+
+    def decide(self, features: Dict) -> RouteDecision:
+        """Route for a turn described by features"""
+        route, rule = self.default_route, "default"
+        if self.enabled:
+            for candidate in self.rules:
+                if self._matches(candidate.get('when') or {}, features):
+                    route, rule = candidate['route'], candidate.get('name', candidate['route'])
+                    break
+        LLM_ROUTES.inc(route=route, rule=rule)
+        logging.info(f"Routed turn to {route} ({rule})")
+        settings = self.routes[route]
+        return RouteDecision(route, settings['model'], int(settings.get('max_tokens', 800)), rule)
+
+    def route_for_model(self, model: str) -> str:
+        return self._route_by_model.get(model, "unrouted")
+
+    def cheapest_model(self) -> str:
+        """Model with the lowest input price, for health checks"""
+        return min(self.routes.values(), key=lambda route: (route.get('pricing') or {}).get('input', float('inf')))['model']
+
+    def record_call(self, model: str, seconds: float, response=None):
+        """Per-route latency and, from the response usage, cost"""
+        route = self.route_for_model(model)
+        ROUTE_LATENCY.observe(seconds, route=route)
+        usage = getattr(response, 'usage', None)
+        pricing = self.routes.get(route, {}).get('pricing')
+        if usage is None or not pricing:
+            return
+        cost = 0.0
+        for token_type, attribute in (("input", "input_tokens"), ("output", "output_tokens"),
+                                      ("cache_read", "cache_read_input_tokens"),
+                                      ("cache_write", "cache_creation_input_tokens")):
+            count = getattr(usage, attribute, None)
+            if isinstance(count, (int, float)):
+                cost += count * pricing.get(token_type, 0) / 1_000_000
+        if cost:
+            LLM_COST.inc(cost, route=route, model=model)
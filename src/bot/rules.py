@@ -0,0 +1,88 @@
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence
+from src.bot.pattern_matcher import PatternMatcher
+
+# Used for any class config/compliance_rules.yaml does not define
+DEFAULT_RULE_CLASSES = {
+    'returns_question': {'keywords': ['תשואה', 'תשואות', 'ריבית', 'קופון', 'רווח', 'רווחים',
+                                      'החזר', 'אחוזים', 'תשלום תקופתי']},
+    'agreement_request': {'keywords': ['הסכם', 'חוזה', 'התקשרות']},
+    'needs_disclaimer': {'keywords': ['תשואה', 'ריבית', 'רווח', 'החזר', 'השקעה', 'סיכון', 'הגנה', 'קרן']},
+    'restricted_info': {'patterns': [r'\d+%', 'קופון של', 'תשואה של', 'ריבית של', 'החזר של', 'רווח של']},
+    'agreement_form_link': {'keywords': ['הסכם', 'חוזה', 'טופס']},
+    'qualified_investor_form_link': {'keywords': ['משקיע כשיר']},
+    'meeting_mention': {'keywords': ['פגישה']},
+    'email_mention': {'keywords': ['מייל']},
+    'investment_mention': {'keywords': ['השקעה']},
+    'signature_mention': {'keywords': ['חתימה', 'הסכם']}
+}
+
+
+class ScanResult(NamedTuple):
+    classes: FrozenSet[str]
+    # Index of the highest-priority canned response pattern found, or None
+    canned: Optional[int]
+
+
+class RuleEngine:
+    """Every keyword rule and canned response pattern, compiled into one automaton.
+
+    scan() lowercases a text, walks it once and returns all matched rule
+    classes together with the canned response pattern that wins (the first
+    one listed). Regex rules, of which there are few, are searched per
+    class. Results for recent texts are kept, so the checks made on one
+    message during a turn share a single scan.
+    """
+
+    def __init__(self, rule_classes: Dict[str, Dict], canned_patterns: Sequence[str] = (), cache_size: int = 256):
+        terms: List[str] = []
+        self._term_class: List[Optional[str]] = []
+        self.canned_patterns = list(canned_patterns)
+        # Canned patterns first, so their automaton index is their priority
+        for pattern in self.canned_patterns:
+            terms.append(pattern.lower())
+            self._term_class.append(None)
+
+        self._regexes: Dict[str, re.Pattern] = {}
+        for rule_class, rule in rule_classes.items():
+            for keyword in rule.get('keywords') or []:
+                terms.append(str(keyword).lower())
+                self._term_class.append(rule_class)
+            patterns = rule.get('patterns') or []
+            if patterns:
+                self._regexes[rule_class] = re.compile("|".join(f"(?:{pattern})" for pattern in patterns),
+                                                       re.IGNORECASE)
+        self.classes = frozenset(rule_classes)
+        self._matcher = PatternMatcher(terms)
+        self.scan = lru_cache(maxsize=cache_size)(self._scan)
+
+    @classmethod
+    def from_config(cls, compliance_rules: Optional[Dict], canned_patterns: Sequence[str] = ()) -> 'RuleEngine':
+        """Rule classes from compliance_rules.yaml, defaults filling in any it leaves out"""
+        rule_classes = dict(DEFAULT_RULE_CLASSES)
+        configured = (compliance_rules or {}).get('rule_classes') or {}
+        if isinstance(configured, dict):
+            rule_classes.update(configured)
+        else:
+            logging.error("compliance_rules.yaml rule_classes must be a mapping, using defaults")
+        return cls(rule_classes, canned_patterns)
+
+    def _scan(self, text: str) -> ScanResult:
+        classes = set()
+        canned = None
+        canned_count = len(self.canned_patterns)
+        for _, index in self._matcher.iter_matches(text.lower()):
+            if index < canned_count:
+                if canned is None or index < canned:
+                    canned = index
+            else:
+                classes.add(self._term_class[index])
+        for rule_class, regex in self._regexes.items():
+            if rule_class not in classes and regex.search(text):
+                classes.add(rule_class)
+        return ScanResult(frozenset(classes), canned)
+
+    def matches(self, text: str, rule_class: str) -> bool:
+        return rule_class in self.scan(text).classes
@@ -0,0 +1,95 @@
+import logging
+import math
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+from src.utils.metrics import PROMPT_BUDGET_TRIMMED, PROMPT_TOKENS
+
+HEBREW = re.compile('[\u0590-\u05FF]')
+TRUNCATION_MARK = "…"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Claude token count without calling the API.
+
+    Hebrew letters cost about one token per two characters, Latin text,
+    digits and whitespace about one per four; this errs on the high side.
+    """
+    if not text:
+        return 0
+    hebrew = len(HEBREW.findall(text))
+    return math.ceil(hebrew / 2 + (len(text) - hebrew) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of text (cut at a word boundary, marked with …) estimated within max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    length = int(len(text) * max_tokens / estimate_tokens(text))
+    while length > 0:
+        cut = text[:length]
+        if ' ' in cut.strip():
+            cut = cut.rsplit(' ', 1)[0]
+        candidate = cut.rstrip() + TRUNCATION_MARK
+        if estimate_tokens(candidate) <= max_tokens:
+            return candidate
+        length = int(length * 0.9)
+    return ""
+
+
+class TokenBudget:
+    """Pack optional prompt sections into a fixed input token budget.
+
+    Fixed parts (system prompt, user message) are always sent. Optional
+    sections are filled in priority order and their items in value order;
+    an item that does not fit is truncated when at least min_item_tokens
+    remain, otherwise it and every lower-value item are dropped.
+    """
+
+    def __init__(self, budget: Optional[int] = None, min_item_tokens: Optional[int] = None):
+        self.budget = budget or int(os.getenv('PROMPT_TOKEN_BUDGET', 3000))
+        self.min_item_tokens = min_item_tokens or int(os.getenv('PROMPT_BUDGET_MIN_ITEM_TOKENS', 40))
+
+    def pack(self, fixed: Dict[str, str], sections: Sequence[Tuple[str, List[str]]]) -> Tuple[Dict[str, List[str]], Dict]:
+        """Kept items per section, still in value order, and the budget breakdown.
+
+        fixed maps a part name to text that is always sent; sections is a list
+        of (name, items) with the highest-priority section and item first.
+        """
+        used = {name: estimate_tokens(text) for name, text in fixed.items()}
+        remaining = self.budget - sum(used.values())
+        if remaining < 0:
+            logging.warning(f"Fixed prompt parts use {sum(used.values())} tokens, over the {self.budget} token budget")
+
+        kept: Dict[str, List[str]] = {}
+        trimmed: Dict[str, int] = {}
+        for name, items in sections:
+            kept[name] = []
+            used[name] = 0
+            for position, item in enumerate(items):
+                cost = estimate_tokens(item)
+                if cost <= remaining:
+                    kept[name].append(item)
+                elif remaining >= self.min_item_tokens:
+                    item = truncate_to_tokens(item, remaining)
+                    kept[name].append(item)
+                    cost = estimate_tokens(item)
+                    PROMPT_BUDGET_TRIMMED.inc(section=name, action="truncated")
+                    trimmed[name] = trimmed.get(name, 0) + 1
+                else:
+                    dropped = len(items) - position
+                    PROMPT_BUDGET_TRIMMED.inc(dropped, section=name, action="dropped")
+                    trimmed[name] = trimmed.get(name, 0) + dropped
+                    break
+                used[name] += cost
+                remaining -= cost
+
+        for name, tokens in used.items():
+            PROMPT_TOKENS.observe(tokens, section=name)
+        report = {"budget": self.budget, "total": sum(used.values()), "sections": used, "trimmed": trimmed}
+        logging.info(
+            "Prompt budget - " + ", ".join(f"{name}: {tokens}" for name, tokens in used.items())
+            + f", total: {report['total']}/{self.budget}"
+            + (f", trimmed: {trimmed}" if trimmed else "")
+        )
+        return kept, report
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+
+class Components:
+    """Application-scoped components shared by the API and its routers.
+
+    Each component is built once, on first access or in the background via
+    warm_up(), and reused by every request afterwards. Imports happen inside
+    the builders so routers can depend on this module without import cycles,
+    and so heavy modules (anthropic, yaml, pandas) load only when needed.
+    """
+
+    def __init__(self):
+        self._instances = {}
+        self._lock = threading.RLock()
+        self._warm_up: Optional[asyncio.Future] = None
+
+    def _get(self, name: str, build):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = build()
+                    self._instances[name] = instance
+                    logging.info(f"Initialized component: {name}")
+        return instance
+
+    @property
+    def db_manager(self):
+        def build():
+            from src.database.models import DatabaseManager
+            return DatabaseManager()
+        return self._get('db_manager', build)
+
+    @property
+    def async_db(self):
+        def build():
+            from src.bot.async_context import AsyncDatabase
+            return AsyncDatabase(self.db_manager)
+        return self._get('async_db', build)
+
+    @property
+    def response_cache(self):
+        def build():
+            from src.bot.response_cache import ResponseCache
+            return ResponseCache(self.db_manager)
+        return self._get('response_cache', build)
+
+    @property
+    def bot_context(self):
+        def build():
+            from src.bot.async_context import AsyncBotContext
+            return AsyncBotContext(response_cache=self.response_cache)
+        return self._get('bot_context', build)
+
+    @property
+    def lead_tracker(self):
+        def build():
+            from src.utils.lead_tracker import LeadTracker
+            return LeadTracker(self.db_manager)
+        return self._get('lead_tracker', build)
+
+    @property
+    def dashboard_manager(self):
+        def build():
+            from src.dashboard.analytics import DashboardManager
+            return DashboardManager(self.db_manager)
+        return self._get('dashboard_manager', build)
+
+    @property
+    def conversation_viewer(self):
+        def build():
+            from src.utils.conversation_viewer import ConversationViewer
+            return ConversationViewer(self.db_manager)
+        return self._get('conversation_viewer', build)
+
+    def init_all(self):
+        """Build every component up front, e.g. from a startup hook"""
+        for name in ('db_manager', 'async_db', 'response_cache', 'bot_context', 'lead_tracker',
+                     'dashboard_manager', 'conversation_viewer'):
+            getattr(self, name)
+
+    def is_built(self, name: str) -> bool:
+        return name in self._instances
+
+    def warm_up(self) -> asyncio.Future:
+        """Run init_all() in a worker thread, once; a failed attempt is retried on the next call"""
+        task = self._warm_up
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = self._warm_up = asyncio.ensure_future(asyncio.to_thread(self.init_all))
+            task.add_done_callback(self._log_warm_up)
+        return task
+
+    @staticmethod
+    def _log_warm_up(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Component warm-up failed: {str(task.exception())}")
+
+    async def ready(self):
+        """Wait until every component is built, without blocking the event loop"""
+        await asyncio.shield(self.warm_up())
+
+
+components = Components()
+
+
+# FastAPI dependencies
+def get_lead_tracker():
+    return components.lead_tracker
+
+
+def get_dashboard_manager():
+    return components.dashboard_manager
+
+
+def get_conversation_viewer():
+    return components.conversation_viewer
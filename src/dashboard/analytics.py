@@ -1,17 +1,20 @@
-import pandas as pd
 from fastapi import APIRouter, Depends, HTTPException
 from typing import List, Dict, Any
 import logging
 from datetime import datetime, timedelta
 import json
+# pandas is imported inside the report methods so booting the API does not load it
+from src.container import get_dashboard_manager
+from src.utils.responses import FastJSONResponse
 
-router = APIRouter(prefix="/dashboard", tags=["dashboard"])
+router = APIRouter(prefix="/dashboard", tags=["dashboard"], default_response_class=FastJSONResponse)
 
 class DashboardManager:
     def __init__(self, db_manager):
         self.db_manager = db_manager
 
     def get_summary_stats(self) -> Dict[str, Any]:
+        import pandas as pd
         try:
             conn = self.db_manager.get_connection()
             stats = pd.read_sql_query("""
@@ -47,6 +50,7 @@ class DashboardManager:
             conn.close()
 
     def get_conversations(self) -> List[Dict[str, Any]]:
+        import pandas as pd
         try:
             conn = self.db_manager.get_connection()
             conversations = pd.read_sql_query("""
@@ -85,6 +89,7 @@ class DashboardManager:
             conn.close()
 
     def get_leads(self) -> List[Dict[str, Any]]:
+        import pandas as pd
         try:
             conn = self.db_manager.get_connection()
             leads = pd.read_sql_query("""
@@ -107,6 +112,7 @@ class DashboardManager:
             conn.close()
 
     def get_agreements(self) -> List[Dict[str, Any]]:
+        import pandas as pd
         try:
             conn = self.db_manager.get_connection()
             agreements = pd.read_sql_query("""
@@ -130,17 +136,17 @@ class DashboardManager:
 
 # FastAPI router endpoints
 @router.get("/summary")
-async def get_summary(dashboard: DashboardManager = Depends()):
-    return dashboard.get_summary_stats()
+async def get_summary(dashboard: DashboardManager = Depends(get_dashboard_manager)):
+    return FastJSONResponse(dashboard.get_summary_stats())
 
 @router.get("/conversations")
-async def get_conversations(dashboard: DashboardManager = Depends()):
-    return dashboard.get_conversations()
+async def get_conversations(dashboard: DashboardManager = Depends(get_dashboard_manager)):
+    return FastJSONResponse(dashboard.get_conversations())
 
 @router.get("/leads")
-async def get_leads(dashboard: DashboardManager = Depends()):
-    return dashboard.get_leads()
+async def get_leads(dashboard: DashboardManager = Depends(get_dashboard_manager)):
+    return FastJSONResponse(dashboard.get_leads())
 
 @router.get("/agreements")
-async def get_agreements(dashboard: DashboardManager = Depends()):
-    return dashboard.get_agreements()
+async def get_agreements(dashboard: DashboardManager = Depends(get_dashboard_manager)):
+    return FastJSONResponse(dashboard.get_agreements())
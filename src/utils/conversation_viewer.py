@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from datetime import datetime, date
 from typing import List, Dict, Optional
 import os
@@ -11,8 +11,10 @@ src_dir = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(src_dir)
 
 from src.database.models import DatabaseManager
+from src.container import get_conversation_viewer
+from src.utils.responses import FastJSONResponse
 
-router = APIRouter(prefix="/conversations", tags=["conversations"])
+router = APIRouter(prefix="/conversations", tags=["conversations"], default_response_class=FastJSONResponse)
 
 class ConversationFilter(BaseModel):
     leads_only: bool = False
@@ -98,27 +100,27 @@ class ConversationViewer:
 @router.get("/", response_model=List[Conversation])
 async def get_conversations(
     leads_only: bool = Query(False, description="Filter to show only leads"),
-    filter_date: Optional[date] = Query(None, description="Filter by specific date")
+    filter_date: Optional[date] = Query(None, description="Filter by specific date"),
+    viewer: ConversationViewer = Depends(get_conversation_viewer)
 ):
     """Get filtered conversations"""
     try:
-        db = DatabaseManager()
-        viewer = ConversationViewer(db)
-        return viewer.get_filtered_conversations(leads_only, filter_date)
+        return FastJSONResponse(viewer.get_filtered_conversations(leads_only, filter_date))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{conversation_id}", response_model=Conversation)
-async def get_conversation(conversation_id: str):
+async def get_conversation(
+    conversation_id: str,
+    viewer: ConversationViewer = Depends(get_conversation_viewer)
+):
     """Get a specific conversation by ID"""
     try:
-        db = DatabaseManager()
-        viewer = ConversationViewer(db)
         conversations = viewer.get_filtered_conversations()
         
         for conv in conversations:
             if conv['conversation_id'] == conversation_id:
-                return conv
+                return FastJSONResponse(conv)
                 
         raise HTTPException(status_code=404, detail="Conversation not found")
     except Exception as e:
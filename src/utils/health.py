@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+
+class ReadinessProbe:
+    """Dependency checks cached for a TTL and refreshed in the background.
+
+    snapshot() never performs I/O; it returns the last results and, when they
+    are older than the TTL, schedules a refresh without waiting for it.
+    """
+
+    def __init__(self, checks: Dict[str, Callable[[], Awaitable]], ttl: Optional[float] = None,
+                 timeout: Optional[float] = None):
+        self.checks = checks
+        self.ttl = ttl or float(os.getenv('READINESS_TTL', 30))
+        self.timeout = timeout or float(os.getenv('READINESS_CHECK_TIMEOUT', 5))
+        self.results = {
+            name: {'ok': False, 'error': 'not checked yet', 'checked_at': None}
+            for name in checks
+        }
+        self.last_refresh: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    async def _run_check(self, name: str, check: Callable[[], Awaitable]) -> Dict:
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(check(), timeout=self.timeout)
+            result = {'ok': True, 'error': None}
+        except Exception as e:
+            logging.warning(f"Readiness check '{name}' failed: {str(e)}")
+            result = {'ok': False, 'error': str(e) or type(e).__name__}
+        result['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+        result['checked_at'] = time.time()
+        return result
+
+    async def refresh(self):
+        """Run every check concurrently and store the results"""
+        names = list(self.checks)
+        results = await asyncio.gather(*[self._run_check(name, self.checks[name]) for name in names])
+        self.results = dict(zip(names, results))
+        self.last_refresh = time.monotonic()
+
+    def _is_stale(self) -> bool:
+        return self.last_refresh is None or time.monotonic() - self.last_refresh > self.ttl
+
+    def snapshot(self) -> Dict:
+        """Cached readiness state, scheduling a background refresh when stale"""
+        if self._is_stale() and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.ensure_future(self.refresh())
+        return {
+            'ready': all(result['ok'] for result in self.results.values()),
+            'checks': self.results,
+            'age_seconds': None if self.last_refresh is None else round(time.monotonic() - self.last_refresh, 1)
+        }
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(f"Readiness refresh failed: {str(e)}")
+            await asyncio.sleep(self.ttl)
+
+    def start(self):
+        """Start refreshing every TTL seconds"""
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._loop_task, self._refresh_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an Idempotency-Key is reused with a different request body"""
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'task', 'expires_at')
+
+    def __init__(self, fingerprint: str, task: asyncio.Task, expires_at: float):
+        self.fingerprint = fingerprint
+        self.task = task
+        self.expires_at = expires_at
+
+
+class IdempotencyStore:
+    """In-process store of request results keyed by Idempotency-Key.
+
+    The first request for a key runs the handler; a retry that arrives while it
+    is still running awaits the same task, and a later retry gets the stored
+    result until the TTL expires. Failed runs are forgotten so a retry can try
+    again. The handler keeps running if the original client disconnects, so
+    its retry can still pick up the result.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl or float(os.getenv('IDEMPOTENCY_TTL', 3600))
+        self.max_entries = max_entries or int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000))
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.replayed = 0
+
+    @staticmethod
+    def fingerprint(payload: Any) -> str:
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def _purge(self):
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            if not entry.task.done() and entry.expires_at > now:
+                # Never evict a request that is still running
+                self._entries.move_to_end(key)
+                break
+            del self._entries[key]
+
+    async def run(self, key: str, fingerprint: str, handler: Callable[[], Awaitable[Any]],
+                  cacheable: Callable[[Any], bool] = lambda result: True) -> Tuple[Any, bool]:
+        """Run handler once per key; returns (result, replayed)"""
+        self._purge()
+        entry = self._entries.get(key)
+        replayed = entry is not None
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+            self.replayed += 1
+            logging.info(f"Replaying idempotent request {key}")
+        else:
+            task = asyncio.ensure_future(handler())
+            entry = _Entry(fingerprint, task, time.monotonic() + self.ttl)
+            self._entries[key] = entry
+            task.add_done_callback(lambda done: self._on_done(key, entry, cacheable))
+
+        return await asyncio.shield(entry.task), replayed
+
+    def _on_done(self, key: str, entry: _Entry, cacheable: Callable[[Any], bool]):
+        task = entry.task
+        failed = task.cancelled() or task.exception() is not None
+        if (failed or not cacheable(task.result())) and self._entries.get(key) is entry:
+            del self._entries[key]
@@ -2,11 +2,12 @@ import re
 import uuid
 from datetime import datetime
 import logging
-import pandas as pd
 import json
+# pandas is imported inside the report methods so booting the API does not load it
 from fastapi import APIRouter, HTTPException, Depends
 from typing import Dict, List, Optional
 from pydantic import BaseModel
+from src.container import get_lead_tracker
 
 router = APIRouter(prefix="/leads", tags=["leads"])
 
@@ -185,6 +186,7 @@ class LeadTracker:
 
     def get_recent_leads(self, days: int = 7) -> List[Dict]:
         """Get recent leads from database"""
+        import pandas as pd
         try:
             conn = self.db_manager.get_connection()
             
@@ -260,6 +262,7 @@ class LeadTracker:
 
     def get_conversation_history(self, conversation_id: str) -> List[Dict]:
         """Get conversation history"""
+        import pandas as pd
         try:
             conn = self.db_manager.get_connection()
             messages_df = pd.read_sql_query('''
@@ -279,13 +282,13 @@ class LeadTracker:
 
 # FastAPI router endpoints
 @router.get("/recent")
-async def get_recent_leads(days: int = 7, tracker: LeadTracker = Depends()):
+async def get_recent_leads(days: int = 7, tracker: LeadTracker = Depends(get_lead_tracker)):
     return tracker.get_recent_leads(days)
 
 @router.put("/{lead_id}")
-async def update_lead(lead_id: str, update: LeadUpdate, tracker: LeadTracker = Depends()):
+async def update_lead(lead_id: str, update: LeadUpdate, tracker: LeadTracker = Depends(get_lead_tracker)):
     return tracker.update_lead_status(lead_id, update)
 
 @router.get("/conversation/{conversation_id}")
-async def get_conversation(conversation_id: str, tracker: LeadTracker = Depends()):
+async def get_conversation(conversation_id: str, tracker: LeadTracker = Depends(get_lead_tracker)):
     return tracker.get_conversation_history(conversation_id)
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Optional, Set
+
+
+class ShuttingDown(Exception):
+    """Raised when a chat turn starts after the server began draining"""
+
+    def __init__(self, retry_after: int = 5):
+        super().__init__("Server is shutting down")
+        self.retry_after = retry_after
+
+
+class Lifecycle:
+    """Tracks in-flight chat turns and background jobs so shutdown can drain them.
+
+    Once draining starts, new turns are refused with ShuttingDown. drain()
+    waits for running turns and jobs until the deadline, then cancels what is
+    left and gives the cancelled tasks a short grace period to persist their
+    state before the process exits.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, grace: Optional[float] = None):
+        self.timeout = timeout or float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', 25))
+        self.grace = grace or float(os.getenv('SHUTDOWN_CANCEL_GRACE', 3))
+        self.draining = False
+        self._tasks: Set[asyncio.Future] = set()
+        self._drain_task: Optional[asyncio.Task] = None
+        self._deadline: Optional[float] = None
+
+    @property
+    def in_flight(self) -> int:
+        return sum(1 for task in self._tasks if not task.done())
+
+    @asynccontextmanager
+    async def track(self):
+        """Run a chat turn; it is waited for (or cancelled at the deadline) on shutdown"""
+        if self.draining:
+            raise ShuttingDown()
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            yield
+        finally:
+            self._tasks.discard(task)
+
+    def spawn(self, coro: Awaitable) -> asyncio.Future:
+        """Run a background job that shutdown waits for"""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._job_done)
+        return task
+
+    def _job_done(self, task: asyncio.Future):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Background job failed: {str(task.exception())}")
+
+    def begin_drain(self):
+        """Refuse new turns and start the drain deadline; safe to call from a signal handler"""
+        if self.draining:
+            return
+        self.draining = True
+        self._deadline = time.monotonic() + self.timeout
+        logging.info(f"Draining {self.in_flight} in-flight chat tasks, deadline {self.timeout:.0f}s")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.call_soon_threadsafe(self._start_drain)
+
+    def _start_drain(self):
+        if self._drain_task is None:
+            self._drain_task = asyncio.ensure_future(self._drain())
+
+    async def drain(self):
+        """Drain in-flight work, reusing a drain already started by begin_drain()"""
+        self.begin_drain()
+        self._start_drain()
+        await asyncio.shield(self._drain_task)
+
+    async def _drain(self):
+        pending = {task for task in self._tasks if not task.done()}
+        if pending:
+            remaining = max(0.0, self._deadline - time.monotonic())
+            _, pending = await asyncio.wait(pending, timeout=remaining)
+        # Jobs spawned while draining (e.g. final saves) are waited for too
+        pending |= {task for task in self._tasks if not task.done()}
+        if not pending:
+            logging.info("Drain complete")
+            return
+
+        logging.warning(f"Drain deadline reached, cancelling {len(pending)} tasks")
+        for task in pending:
+            task.cancel()
+        await asyncio.wait(pending, timeout=self.grace)
+        # Saves spawned by the cancelled tasks
+        leftovers = {task for task in self._tasks if not task.done()}
+        if leftovers:
+            await asyncio.wait(leftovers, timeout=self.grace)
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,278 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Gauge read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self) -> List[str]:
+        try:
+            value = self.callback()
+        except Exception as e:
+            logging.error(f"Failed to read gauge {self.name}: {str(e)}")
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # per-bucket counts, sum, count
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, [list(series[0]), series[1], series[2]]) for key, series in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float]) -> Gauge:
+        metric = Gauge(name, documentation, callback)
+        self._metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_LATENCY = REGISTRY.histogram(
+    "movne_http_request_duration_seconds", "HTTP request latency until the response completes",
+    ["method", "route", "status"]
+)
+STAGE_LATENCY = REGISTRY.histogram(
+    "movne_chat_stage_duration_seconds", "Latency of each chat pipeline stage", ["stage"]
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "movne_response_cache_lookups_total", "Response cache lookups by result", ["cache", "result"]
+)
+LLM_TOKENS = REGISTRY.counter(
+    "movne_llm_tokens_total", "Anthropic tokens by model and type", ["model", "type"]
+)
+LLM_REQUESTS = REGISTRY.counter(
+    "movne_llm_requests_total", "Anthropic calls by model and outcome", ["model", "outcome"]
+)
+LLM_CANCELLED = REGISTRY.counter(
+    "movne_llm_cancelled_total", "Claude calls abandoned because the client disconnected or shutdown cut them off",
+    ["model"]
+)
+LLM_REJECTED = REGISTRY.counter(
+    "movne_llm_rejected_total", "Requests rejected by admission control", ["reason"]
+)
+LLM_RETRIES = REGISTRY.counter(
+    "movne_llm_retries_total", "Claude attempts retried after a transient failure", ["model"]
+)
+LLM_FALLBACKS = REGISTRY.counter(
+    "movne_llm_fallbacks_total", "Turns answered from canned content because Claude was unavailable", ["reason"]
+)
+LLM_ROUTES = REGISTRY.counter(
+    "movne_llm_routes_total", "Chat turns by model route and the routing rule that picked it", ["route", "rule"]
+)
+ROUTE_LATENCY = REGISTRY.histogram(
+    "movne_llm_route_duration_seconds", "Claude call latency by model route", ["route"]
+)
+LLM_COST = REGISTRY.counter(
+    "movne_llm_cost_usd_total", "Estimated Claude spend in USD from the routing policy prices", ["route", "model"]
+)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "movne_prompt_tokens", "Estimated input tokens per prompt section after budget packing", ["section"],
+    buckets=(25, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+)
+PROMPT_BUDGET_TRIMMED = REGISTRY.counter(
+    "movne_prompt_budget_trimmed_total", "Prompt items truncated or dropped to fit the token budget",
+    ["section", "action"]
+)
+DB_OPERATIONS = REGISTRY.counter(
+    "movne_db_operations_total", "Database operations issued by the chat pipeline", ["operation"]
+)
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_llm_usage(model: str, response):
+    """Count and log tokens reported in a Claude response"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    counts = {}
+    for token_type, attribute in (("input", "input_tokens"), ("output", "output_tokens"),
+                                  ("cache_read", "cache_read_input_tokens"),
+                                  ("cache_write", "cache_creation_input_tokens")):
+        count = getattr(usage, attribute, None)
+        counts[token_type] = count if isinstance(count, (int, float)) else 0
+        if counts[token_type]:
+            LLM_TOKENS.inc(counts[token_type], model=model, type=token_type)
+    # Prompt caching is working when cache_read is non-zero after the first call
+    logging.info(
+        f"Claude usage - model: {model}, input: {counts['input']}, output: {counts['output']}, "
+        f"cache_read: {counts['cache_read']}, cache_write: {counts['cache_write']}"
+    )
+
+
+def record_llm_cancelled(model: str, input_tokens: int = 0, output_tokens: int = 0):
+    """Count an abandoned Claude call and the tokens it had already used"""
+    LLM_CANCELLED.inc(model=model)
+    if input_tokens:
+        LLM_TOKENS.inc(input_tokens, model=model, type="cancelled_input")
+    if output_tokens:
+        LLM_TOKENS.inc(output_tokens, model=model, type="cancelled_output")
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_LATENCY.observe(
+                time.perf_counter() - started,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", "unmatched"),
+                status=status
+            )
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# (bucket key, capacity, refill per second)
+Bucket = Tuple[str, float, float]
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a token bucket has no tokens left"""
+
+    def __init__(self, scope: str, retry_after: int):
+        super().__init__(f"Rate limit exceeded for {scope}, retry after {retry_after}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class MemoryBucketBackend:
+    """Token buckets held in this process only"""
+
+    blocking = False
+
+    def __init__(self, max_buckets: int = 100000):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, buckets: Sequence[Bucket], cost: float = 1) -> Tuple[Optional[int], float]:
+        """Take cost tokens from every bucket, or from none of them.
+
+        Returns (index of the first bucket without enough tokens or None,
+        seconds until it has them).
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, capacity, refill_per_second in buckets:
+                tokens, updated_at = self._buckets.pop(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated_at) * refill_per_second))
+            rejected = next((i for i, tokens in enumerate(levels) if tokens < cost), None)
+            for (key, _, _), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens - cost if rejected is None else tokens, now)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return rejected, _wait(buckets, levels, rejected, cost)
+
+
+class SQLiteBucketBackend:
+    """Token buckets in a local SQLite file, shared by every worker on the host.
+
+    Each take is one IMMEDIATE transaction over all of a request's buckets,
+    so concurrent workers serialize on the update instead of racing.
+    """
+
+    blocking = True
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('''CREATE TABLE IF NOT EXISTS rate_limit_buckets
+                         (bucket_key TEXT PRIMARY KEY,
+                          tokens REAL,
+                          updated_at REAL)''')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def take(self, buckets: Sequence[Bucket], cost: float = 1) -> Tuple[Optional[int], float]:
+        """Same contract as MemoryBucketBackend.take"""
+        # Wall clock, since monotonic clocks are not comparable across processes
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            levels = []
+            for key, capacity, refill_per_second in buckets:
+                row = conn.execute('SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket_key = ?',
+                                   (key,)).fetchone()
+                tokens, updated_at = row if row else (capacity, now)
+                levels.append(min(capacity, tokens + max(0.0, now - updated_at) * refill_per_second))
+            rejected = next((i for i, tokens in enumerate(levels) if tokens < cost), None)
+            conn.executemany('INSERT OR REPLACE INTO rate_limit_buckets (bucket_key, tokens, updated_at) VALUES (?, ?, ?)',
+                             [(key, tokens - cost if rejected is None else tokens, now)
+                              for (key, _, _), tokens in zip(buckets, levels)])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return rejected, _wait(buckets, levels, rejected, cost)
+
+
+def _wait(buckets: Sequence[Bucket], levels: List[float], rejected: Optional[int], cost: float) -> float:
+    """Seconds until the rejecting bucket refills enough for cost"""
+    if rejected is None:
+        return 0.0
+    return (cost - levels[rejected]) / buckets[rejected][2]
+
+
+def parse_rate(value: str) -> Tuple[float, float]:
+    """Parse "capacity/seconds" (e.g. "20/60") into (capacity, refill per second)"""
+    capacity, _, period = value.partition('/')
+    capacity = float(capacity)
+    period = float(period or 1)
+    return capacity, capacity / period
+
+
+class RateLimiter:
+    """Token-bucket limiter with one bucket per scope and identity.
+
+    limits maps a scope name (api_key, conversation, ip) to (capacity, refill
+    per second). Scopes without a limit, or identities that are empty, are not
+    throttled.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], backend=None):
+        self.limits = limits
+        self._backend = backend
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> 'RateLimiter':
+        limits = {}
+        for scope, default in (('api_key', '600/60'), ('conversation', '20/60'), ('ip', '60/60')):
+            value = os.getenv(f'RATE_LIMIT_{scope.upper()}', default)
+            if value and value != '0':
+                limits[scope] = parse_rate(value)
+        return cls(limits)
+
+    @property
+    def backend(self):
+        # Built on first use so importing the API does no file I/O
+        if self._backend is None:
+            if os.getenv('RATE_LIMIT_BACKEND', 'memory') == 'sqlite':
+                self._backend = SQLiteBucketBackend(os.getenv('RATE_LIMIT_SQLITE_PATH', 'database/rate_limits.db'))
+            else:
+                self._backend = MemoryBucketBackend()
+            logging.info(f"Rate limiter using {type(self._backend).__name__}")
+        return self._backend
+
+    def _check(self, identities: Dict[str, Optional[str]], cost: float):
+        # All buckets are checked before any is charged, so a request rejected by
+        # one scope does not use up tokens of another (e.g. the shared api_key)
+        scopes = [scope for scope, identity in identities.items() if identity and scope in self.limits]
+        if not scopes:
+            return
+        buckets = [(f"{scope}:{identities[scope]}",) + tuple(self.limits[scope]) for scope in scopes]
+        rejected, wait = self.backend.take(buckets, cost)
+        if rejected is not None:
+            self.rejected += 1
+            raise RateLimitExceeded(scopes[rejected], max(1, math.ceil(wait)))
+
+    async def check(self, identities: Dict[str, Optional[str]], cost: float = 1):
+        """Take cost tokens from every identity's bucket or raise RateLimitExceeded"""
+        if self.backend.blocking:
+            await asyncio.to_thread(self._check, identities, cost)
+        else:
+            self._check(identities, cost)
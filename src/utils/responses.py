@@ -0,0 +1,36 @@
+import logging
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None
+    logging.warning("orjson not installed, admin payloads use the standard JSON encoder")
+
+
+def _default(obj: Any):
+    """Serialize values orjson does not handle natively (pandas/numpy leftovers)"""
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson.
+
+    Return it directly from an endpoint so FastAPI skips jsonable_encoder and
+    the payload is encoded in a single native pass. Hebrew text is emitted as
+    UTF-8 rather than \\u escapes, which also keeps the body smaller.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+
+import pytest
+
+from src.bot.admission import AdmissionController, OverloadedError
+from src.bot.async_context import AsyncBotContext
+from src.bot.fallback import FallbackResponder
+from src.bot.resilience import CircuitBreaker, LLMUnavailable, ResilientLLM
+from src.utils.metrics import LLM_CANCELLED, LLM_REJECTED
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+
+
+class _Database:
+    """Just the DatabaseManager methods the chat pipeline calls, on a temporary SQLite file"""
+
+    def __init__(self, path):
+        self.db_path = str(path)
+        conn = self.get_connection()
+        conn.execute('''CREATE TABLE conversations
+                     (conversation_id TEXT PRIMARY KEY, start_time TIMESTAMP)''')
+        conn.execute('''CREATE TABLE messages
+                     (message_id TEXT PRIMARY KEY, conversation_id TEXT, timestamp TIMESTAMP,
+                      role TEXT, content TEXT)''')
+        conn.commit()
+        conn.close()
+
+    def get_connection(self):
+        return sqlite3.connect(self.db_path)
+
+    def create_conversation_if_not_exists(self, conversation_id):
+        conn = self.get_connection()
+        conn.execute('INSERT OR IGNORE INTO conversations (conversation_id, start_time) VALUES (?, ?)',
+                     (conversation_id, datetime.now()))
+        conn.commit()
+        conn.close()
+
+    def save_message(self, conversation_id, role, content):
+        self.create_conversation_if_not_exists(conversation_id)
+        conn = self.get_connection()
+        conn.execute('''INSERT INTO messages (message_id, conversation_id, timestamp, role, content)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     (str(uuid.uuid4()), conversation_id, datetime.now(), role, content))
+        conn.commit()
+        conn.close()
+
+    def get_conversation_history(self, conversation_id, limit=None):
+        conn = self.get_connection()
+        rows = conn.execute('SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY timestamp',
+                            (conversation_id,)).fetchall()
+        conn.close()
+        return rows
+
+
+class _Usage:
+    input_tokens = 10
+    output_tokens = 5
+
+
+class _Block:
+    type = 'text'
+
+    def __init__(self, text):
+        self.text = text
+
+
+class _Message:
+    stop_reason = 'end_turn'
+    usage = _Usage()
+
+    def __init__(self, text):
+        self.content = [_Block(text)]
+
+
+class _Stream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def get_final_message(self):
+        return _Message("".join(self.chunks))
+
+
+class _Messages:
+    """Anthropic messages API answering every request with the same text"""
+
+    def __init__(self, answer, delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self, **request):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return _Message(self.answer)
+
+    def stream(self, **request):
+        self.calls += 1
+        words = self.answer.split(' ')
+        return _Stream([(' ' if i else '') + word for i, word in enumerate(words)])
+
+
+class _Client:
+    def __init__(self, answer, delay=0.0):
+        self.messages = _Messages(answer, delay)
+
+
+def make_bot(tmp_path, monkeypatch, answer, delay=0.0):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test')
+    bot = AsyncBotContext(CONFIG_PATH)
+    bot.async_client = _Client(answer, delay)
+    return bot, _Database(tmp_path / 'chat.db')
+
+
+def test_stream_sends_form_links_in_last_delta(tmp_path, monkeypatch):
+    bot, db = make_bot(tmp_path, monkeypatch, "אפשר להתחיל בחתימה על הסכם שיווק")
+
+    async def run():
+        return [chunk async for chunk in bot.stream_response("איך מתחילים לעבוד איתכם", db, 'c1')]
+
+    chunks = asyncio.run(run())
+    assert bot.forms_urls['marketing_agreement'] in chunks[-1]
+    assert bot.forms_urls['marketing_agreement'] in db.get_conversation_history('c1')[-1][1]
+
+
+def test_queue_timeout_does_not_keep_the_prompt(tmp_path, monkeypatch):
+    bot, db = make_bot(tmp_path, monkeypatch, "תשובה", delay=0.5)
+    bot.response_cache = None
+    bot.admission = AdmissionController(max_concurrent=1, max_queue=5, queue_timeout=0.1)
+    before = LLM_REJECTED.value(reason="queue timeout")
+
+    async def run():
+        first = asyncio.ensure_future(bot.get_response_async("שאלה ראשונה", db, 'c1'))
+        await asyncio.sleep(0.05)
+        with pytest.raises(OverloadedError):
+            await bot.get_response_async("שאלה שנייה", db, 'c2')
+        await first
+
+    asyncio.run(run())
+    assert db.get_conversation_history('c2') == []
+    assert [role for role, _ in db.get_conversation_history('c1')] == ['user', 'assistant']
+    assert LLM_REJECTED.value(reason="queue timeout") == before + 1
+
+
+def test_cancelled_waiter_of_a_shared_call_is_not_counted(tmp_path, monkeypatch):
+    bot, db = make_bot(tmp_path, monkeypatch, "תשובה", delay=0.3)
+    bot.response_cache = None
+    model = bot._build_claude_request("שאלה זהה")['model']
+    before = LLM_CANCELLED.value(model=model)
+
+    async def run():
+        # Same prompt in two new conversations: one shared upstream call
+        first = asyncio.ensure_future(bot.get_response_async("שאלה זהה", db, 'c1'))
+        second = asyncio.ensure_future(bot.get_response_async("שאלה זהה", db, 'c2'))
+        await asyncio.sleep(0.1)
+        first.cancel()
+        answer = await second
+        await asyncio.sleep(0.05)
+        return answer
+
+    assert asyncio.run(run()).startswith("תשובה")
+    assert bot.async_client.messages.calls == 1
+    assert LLM_CANCELLED.value(model=model) == before
+
+    async def run_alone():
+        task = asyncio.ensure_future(bot.get_response_async("שאלה אחרת", db, 'c3'))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run_alone())
+    assert LLM_CANCELLED.value(model=model) == before + 1
+
+
+def test_half_open_breaker_lets_one_trial_call_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    llm = ResilientLLM(deadline=5, retries=0, breaker=breaker)
+    client = _Client("תשובה", delay=0.2)
+    breaker.record_failure()
+
+    async def call():
+        try:
+            await llm.create_async(client, {'model': 'm', 'messages': []})
+            return "ok"
+        except LLMUnavailable as e:
+            return e.reason
+
+    async def run():
+        await asyncio.sleep(0.1)
+        return await asyncio.gather(*(call() for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert sorted(results) == ["circuit_open"] * 4 + ["ok"]
+    assert client.messages.calls == 1
+    assert breaker.stats()['state'] == "closed"
+
+
+def test_fallback_replaces_the_greeting_placeholder(tmp_path, monkeypatch):
+    bot, db = make_bot(tmp_path, monkeypatch, "תשובה")
+    bot.responses_cache['שלום'] = "DYNAMIC_GREETING, איך אפשר לעזור?"
+    bot.fallback = FallbackResponder(bot._fallback_candidates(), default="ברירת מחדל")
+
+    answer = bot._fallback_response("שלום", "circuit_open")
+    assert 'DYNAMIC_GREETING' not in answer
+    assert answer.endswith(", איך אפשר לעזור?")